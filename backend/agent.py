@@ -1,138 +1,279 @@
 from datetime import datetime
-import json
+import logging
+import asyncio
 import os
+import random
+import time
+from ollama import AsyncClient
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_ollama import ChatOllama
-# from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-
-documents_path =  os.path.join(os.path.dirname(__file__), "documents")
-
-model_name = "BAAI/bge-m3" # "jhgan/ko-sroberta-multitask" #
-# - NVidia GPU: "cuda"
-# - Mac M1, M2, M3: "mps"
-# - CPU: "cpu"
-model_kwargs = {
-    # "device": "cuda"
-    # "device": "mps"
-    "device": "cpu"
-}
+from embedding_index import EmbeddingIndex
+from embedding_service import EmbeddingService, normalize_text
+from ingest import documents_path
+from domain_classifier import classify_domains
+from conversation_store import ConversationStore
+from llm_scheduler import SchedulerOverloaded
+from model_router import ModelRoute, ModelRouter
+from response_cache import ResponseCache, is_cacheable, is_context_dependent
+from session_cache import SessionCache
+from langchain_core.messages import AIMessage
+from metrics import registry, span, stage_seconds
+from prompt_builder import PromptBudget, build_request_prompt, build_summary_messages, count_tokens
+from model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+# 프롬프트/응답 전문 로그는 PROMPT_LOG_SAMPLE_RATE 비율의 요청만 DEBUG 로 남긴다.
+prompt_logger = logging.getLogger("nk-bot.prompts")
+PROMPT_LOG_SAMPLE_RATE = float(os.getenv("PROMPT_LOG_SAMPLE_RATE", "0.01"))
 
-encode_kwargs = {"normalize_embeddings": True}
-embeddings = HuggingFaceEmbeddings(
-    model_name=model_name,
-    model_kwargs=model_kwargs,
-    encode_kwargs=encode_kwargs,
+prompt_tokens_histogram = registry.histogram(
+    "nkbot_prompt_tokens", "Estimated prompt size in tokens.", "prompt",
+    buckets=(64, 128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192),
 )
 
-# 문서 임베딩
-def embed_documents(documents):
-    return [embeddings.embed_query(doc['text']) for doc in documents]
+def _prompt_log_sampled():
+    return prompt_logger.isEnabledFor(logging.DEBUG) and random.random() < PROMPT_LOG_SAMPLE_RATE
+
+
+# 임베딩 모델은 처음 쓸 때(또는 warmup 에서) 로드된다.
+embeddings = model_registry.lazy("retrieval")
+
+# 문서 청크 임베딩 (한 번의 배치로 인코딩)
+def embed_documents(texts):
+    return embeddings.embed_documents(texts)
 
 # 질문 임베딩
 def embed_query(query):
     return embeddings.embed_query(query)
 
-# 유사도 계산 및 가장 유사한 문서 찾기
-def find_most_similar(query_embedding, document_embeddings, documents):
-    similarities = cosine_similarity([query_embedding], document_embeddings)[0]
-    most_similar_idx = np.argmax(similarities)
-    return documents[most_similar_idx], similarities[most_similar_idx]
-        
-def search_domain_relavant_documents(domain, query):
+# 요청 처리 중 질의 임베딩은 스레드 풀에서 마이크로 배치 + LRU 캐시로 처리
+embedding_service = EmbeddingService(embeddings)
+
+# 도메인별 문서 청크 임베딩 인덱스 (index/ 아래에 저장, 변경된 파일만 다시 임베딩)
+document_index = EmbeddingIndex(documents_path)
+# 멀티 워커 모드에서는 serve.py 가 인덱스를 한 번 만들고 워커는 읽기만 한다.
+INDEX_READ_ONLY = os.getenv("INDEX_READ_ONLY", "0") == "1"
+
+# 여러 도메인에서 가장 관련 있는 청크 상위 k 개를 (문서 id, 문서) 목록과
+# 질문 임베딩으로 돌려준다. 이름 매치로 찾은 경우 임베딩은 None 이다.
+async def search_relevant_documents(domains, query):
+    relevant_docs = []
+    query_embedding = None
     try:
-        domain_path = os.path.join(documents_path, domain)
-        if not os.path.exists(domain_path):
-            raise ValueError(f"Domain path {domain_path} does not exist")
+        for domain in domains:
+            domain_path = os.path.join(documents_path, domain)
+            if not os.path.exists(domain_path):
+                raise ValueError(f"Domain path {domain_path} does not exist")
 
-        relevant_docs = []
-        for filename in os.listdir(domain_path):
-            if filename.endswith(".json"):
-                file_path = os.path.join(domain_path, filename)
-                try:
-                    with open(file_path, "r") as file:
-                        documents  = json.load(file)
-                except json.JSONDecodeError as json_error:
-                    print(f"JSON decode error in file {filename}: {json_error}")
-                    continue  # 문제가 있는 파일은 건너뛰고 다음 파일로 진행
-                document_embeddings = embed_documents(documents)
-                query_embedding = embed_query(query)
-                    
-                # 가장 유사한 문서 찾기
-                most_similar_doc, similarity_score = find_most_similar(query_embedding, document_embeddings, documents)
-                print(f"Most similar doc: {most_similar_doc}, Similarity Score: {similarity_score}")
-                
-                relevant_docs.append(most_similar_doc)
-    
-    except Exception as e:
-        print(f"An error occurred while searching for relevant documents: {e}")
-
-    return relevant_docs
-
-def classify_domain(question: str) -> str:
-    # Implement your domain classification logic here
-    # For simplicity, let's assume the domain is the first word in the question
-    kdrama_keywords = ["별그대", "별에서 온 그대", "흑백", "오징어", "사랑의 불시착", "이태원 클라쓰", "슬기로운 의사생활", "그 겨울, 바람이 분다", "응답하라 1988", "도깨비", "시그널", "사랑의 온도", "펜트하우스", "지금, 헤어지는 중입니다", "위대한 유혹자", "미스터 션샤인", "호텔 델루나", "청춘기록", "어쩌다 발견한 하루", "트래블러", "파르페", "마인", "소년심판", "커튼콜", "치즈인더트랩", "꽃보다 남자", "비밀의 숲", "굿 닥터", "프리사이즈", "마더", "아이리스", "다모", "여명의 눈동자", "신사의 품격", "무정도시", "오또맘", "사이코지만 괜찮아", "괴물", "파스타", "조선혼담공작소 꽃파당", "보좌관", "쇼핑왕 루이", "사내 맞선", "사랑을 믿어요", "악마가 너의 이름을 부를 때", "끝까지 간다", "개와 늑대의 시간", "내 여자친구는 구미호", "식샤를 합시다", "이웃집 악녀", "굿 타이밍", "엄마가 뿔났다", "비행기 태우기", "현정아 사랑해", "알함브라 궁전의 추억", "정글의 법칙", "과속스캔들", "연애소설", "돌아와요, 부산항에", "옹고집", "내 이름은 김삼순", "소녀시대의 기적", "이별이 떠났다", "제빵왕 김탁구", "무한도전", "내 사랑, 금지된 사랑", "태양의 후예", "풍선껌", "비틀즈가 떴다", "유리정원", "이층의 악당", "방과후 설렘", "미생", "기황후", "너의 목소리가 들려", "9회말 2아웃", "고백부부", "애타는 로맨스", "연애의 기술", "순수의 시대", "불가살", "뜻밖의 히어로즈", "베토벤 바이러스", "스카이 캐슬", "부부의 세계", "더 킹: 영원의 군주", "낭만닥터 김사부", "구미호뎐", "하이에나", "동백꽃 필 무렵", "SKY 캐슬", "밥 잘 사주는 예쁜 누나", "김비서가 왜 그럴까", "남자친구", "멜로가 체질", "여신강림", "스타트업"]
-    krecipe_keywords = ["김치찌개", "불고기", "비빔밥", "갈비찜", "잡채", "된장찌개", "떡볶이", "순두부찌개", "상추쌈", "해물파전", "김밥", "삼계탕", "된장국", "막걸리", "전", "우거지국", "스테이크", "오징어볶음", "고등어구이", "미역국", "볶음밥", "갈비탕", "나물반찬", "파전", "찜닭", "간장게장", "귀리죽", "흑미밥", "삼겹살", "양념치킨", "모듬회", "탕수육", "쉐이크", "파스타", "샐러드", "드레싱", "신김치", "핫윙", "청국장", "김치전", "햄버거", "카레", "연어구이", "소고기국", "달걀찜", "리조또", "돈부리", "티라미수", "김치말이국수", "찐빵", "소스", "계란말이", "완자탕", "미숫가루", "수박화채", "차돌박이", "마늘빵", "도넛", "볶음면", "단호박죽", "볶음김치", "미트볼", "스시", "라면", "우동", "냉면", "칼국수", "육개장", "감자탕", "닭갈비", "부대찌개", "짜장면", "짬뽕", "돈까스"]
-    capitalism_keywords = ["자본주의", "시장경제", "소유권", "자유무역", "인플레이션", "노동시장", "공급과 수요", "경쟁", "기업가정신", "자본", "벤처기업", "기업", "소비자", "생산성", "정치경제학", "해외 투자", "자산", "세금", "주식시장", "계몽사상", "소득 불평등", "감세 정책", "경영", "산업 혁명", "경제 성장", "경쟁 우위", "리스 제도", "부의 분배", "자본 투자", "최저임금", "이자율", "해고", "조세 정책", "국가 간 거래", "자유 시장", "소상공인", "할당 경제", "환율", "가치 창출", "혁신", "승리", "선택론", "분배", "보상", "현금 흐름", "독점", "미시경제학", "거시경제학", "효용", "균형", "가격 탄력성", "노동조합", "긴축", "디플레이션", "수입", "수출", "흑자", "적자", "창업", "크라우드펀딩", "전자상거래", "세계화", "시장 구조", "기업의 사회적 책임", "이해관계자", "지속가능성", "투자 수익률", "민영화", "보조금", "무역 전쟁", "협상", "소비자 권리", "법인세", "시장 경쟁", "공급망", "비즈니스 모델", "경제 정책", "강세장", "약세장", "투자 포트폴리오", "생활 수준", "삶의 질", "부", "자산 관리", "부동산", "재정적 자유", "기회비용", "위험 관리", "벤처 캐피털", "사회주의", "협동조합", "공유 경제", "자유 시장 경제", "금융 시장", "주주 가치", "기업 지배구조", "경제적 자유", "시장 실패", "독과점", "규제", "자본 축적", "경제적 효율성", "경제 성장률", "국내 총생산", "자유 기업", "경제적 불평등", "자본 이득"]
-    christianity_keywords = ["신앙", "기도", "성경", "예수님", "교회", "구원", "마음", "믿음", "사랑", "성령", "찬양", "하나님", "주일학교", "부활절", "성체성사", "사도신경", "성경 공부", "예배", "양육", "순종", "헌금", "교회 공동체", "복음", "전도", "사역", "성품", "큐티", "제자도", "구원론", "변화", "은혜", "중보 기도", "축복", "성화", "기독교 가치관", "선교", "행위 구원", "지혜", "가정", "가르침", "바른 신앙생활", "사랑의 실천", "정직", "순결", "소망", "온유", "의", "진리", "사랑의 언약", "타인 존중", "자비", "겸손", "공동체 의식", "자아 발견", "주님 섬김", "부흥", "감사", "기도사역", "사랑의 복음", "경건한 삶", "영성", "개인기도", "순례", "기도회", "한국 기독교", "십자가", "인내", "배려", "선한 삶", "무조건적 사랑", "인류애", "하나님의 뜻", "신약 성경", "구약 성경", "가정 예배", "전국 기도회", "기독교 연합", "심방", "이웃 사랑", "성경적 가치관", "하나님 말씀", "천국 백성", "새 언약", "지속 가능한 발전", "하나님 나라", "성경적 근본주의", "믿음의 투쟁", "사랑의 회복", "주님의 인도하심", "성령 충만", "말씀 묵상", "영적 성장", "교회 봉사", "성경 해석", "기독교 윤리", "종교 개혁", "성찬식", "세례", "부활", "십계명", "성경 암송", "기독교 교육", "선교 여행", "기독교 문화"]
-    democracy_keywords = ["선거", "투표", "국민", "헌법", "자유", "평등", "인권", "삼권분립", "국회", "대통령", "정당", "시민사회", "언론자유", "집회", "시위", "여론", "참정권", "민주화운동", "4.19혁명", "5.18민주화운동", "6월 민주항쟁", "촛불집회", "개헌", "국민청원", "정치참여", "표현의 자유", "다양성", "관용", "공정", "정의", "법치주의", "지방자치", "시민권", "정보공개", "투명성", "책임", "대의민주주의", "직접민주주의", "참여민주주의", "공화국", "국민주권", "보통선거", "비밀선거", "평등선거", "직접선거", "다수결", "소수자 보호", "정치적 다원주의", "권력분립", "견제와 균형", "의회민주주의", "정당정치", "야당", "여당", "선거공약", "정책", "국민투표", "주민투표", "주민소환", "주민발안", "정치교육", "시민교육", "민주시민", "정치인", "국회의원", "지방의회", "지방선거", "총선", "대선", "정치자금", "선거운동", "개표", "당선", "낙선", "정치개혁", "정치발전", "민주화", "독재", "권위주의", "민주정부", "정권교체", "정치참여", "정치의식", "정치문화", "민주주의 지수", "정치적 자유", "언론의 자유", "집회의 자유", "결사의 자유", "사상의 자유", "양심의 자유", "종교의 자유", "정치적 평등", "경제적 평등", "사회적 평등", "기회의 평등", "성평등", "인종평등", "민주적 의사결정", "합의", "토론", "협상", "타협", "갈등해결", "민주적 리더십", "시민단체", "NGO", "정치적 책임", "정치적 투명성", "부패방지", "정치개혁", "정치발전"]
-    freedom_keywords = ["헌법적 보장", "제27조", "법관", "재판 받을 권리", "공개재판", "공개", "공정성", "감시", "당사자주의", "구두변론주의", "공격권", "방어권", "무죄추정", "헌법", "제27조", "형사피고인", "법관 독립성", "자격", "임명 절차", "임기", "신분 보장", "제척", "기피", "회피", "재판 배제", "공정성", "상소제도", "하급심", "상급법원", "재판 청구", "헌법재판소", "위헌 여부", "국민 기본권", "국선변호인 제도", "경제적 이유", "변호인 선임", "국가 지원","재판 공정성 감시", "시민단체", "언론", "사회적 시스템"]
-    
-    if any(keyword in question for keyword in kdrama_keywords):
-        return "kdrama"
-    elif any(keyword in question for keyword in freedom_keywords):
-        return "freedom"
-    elif any(keyword in question for keyword in krecipe_keywords):
-        return "krecipe"
-    elif any(keyword in question for keyword in capitalism_keywords):
-        return "capitalism"
-    elif any(keyword in question for keyword in christianity_keywords):
-        return "christianity"
-    elif any(keyword in question for keyword in democracy_keywords):
-        return "democracy"
-    else:
-        return "general"
+        # 작품명/배우 이름이 정확히 들어 있으면 임베딩 없이 BM25 로 바로 찾는다.
+        with span("lexical_lookup"):
+            results = document_index.lookup(domains, query)
+        if not results:
+            # 질문은 도메인 수와 관계없이 한 번만 임베딩한다.
+            with span("embed_query"):
+                query_embedding = await embedding_service.embed_query(query)
+            with span("similarity_search"):
+                results = document_index.search(domains, query, query_embedding)
+        for doc_id, most_similar_doc, score in results:
+            # 이름 매치는 BM25 점수, 하이브리드 검색은 RRF 점수 (코사인 유사도가 아님)
+            logger.debug("Relevant doc: %s, %s score: %.4f", doc_id, "BM25" if query_embedding is None else "RRF", score)
+            relevant_docs.append((doc_id, most_similar_doc))
+
+    except Exception:
+        logger.exception("An error occurred while searching for relevant documents")
+
+    return relevant_docs, query_embedding
+
+# (도메인 목록, 검색할 도메인 목록) 을 돌려준다.
+def classify_question(question):
+    # 점수가 비슷한 도메인이 여럿이면 모두 검색한다.
+    domains = classify_domains(question)
+    search_domains = [domain for domain in domains if domain != "general"]
+    if not search_domains:
+        # 키워드가 없어도 작품명/배우 이름이 들어 있으면 그 도메인을 검색한다.
+        search_domains = document_index.match_domains(question)
+        if search_domains:
+            domains = search_domains
+    return domains, search_domains
+
+# 모델이 지시를 무시하고 쓰는 표현을 이모지로 치환
+RESPONSE_REPLACEMENTS = {
+    "*꼬리를 흔드는 중*": "🐕",
+    "*하트 이모지*": "👣",
+}
+
+def replace_expressions(text):
+    for expression, emoji in RESPONSE_REPLACEMENTS.items():
+        text = text.replace(expression, emoji)
+    return text
+
+class StreamingReplacer:
+    """청크 경계에 걸친 표현도 치환되도록, 치환 대상의 앞부분일 수 있는 꼬리는 붙잡아 둔다."""
+
+    def __init__(self, replacements=RESPONSE_REPLACEMENTS):
+        self.replacements = replacements
+        self.buffer = ""
+
+    def _pending_length(self):
+        for length in range(min(len(self.buffer), max(map(len, self.replacements)) - 1), 0, -1):
+            tail = self.buffer[-length:]
+            if any(expression.startswith(tail) for expression in self.replacements):
+                return length
+        return 0
+
+    def feed(self, chunk):
+        self.buffer = replace_expressions(self.buffer + chunk)
+        pending = self._pending_length()
+        text = self.buffer[:len(self.buffer) - pending]
+        self.buffer = self.buffer[len(self.buffer) - pending:]
+        return text
+
+    def flush(self):
+        text, self.buffer = self.buffer, ""
+        return text
+
+# 프롬프트에 넣을 최근 대화 개수 (이보다 오래된 대화는 누적 요약으로 대신함)
+CONTEXT_WINDOW = 5
+# 요약되지 않은 오래된 대화가 이만큼 쌓이면 요약을 갱신한다.
+SUMMARY_MIN_ENTRIES = int(os.getenv("SUMMARY_MIN_ENTRIES", "6"))
+
+# 시스템 메시지는 요청마다 바이트 단위로 같아야 Ollama 가 프롬프트 캐시(KV)를 재사용한다.
+# 요청마다 바뀌는 내용(문서, 대화, 질문)은 모두 human 메시지에 넣는다.
+SYSTEM_INSTRUCTION = """
+You are a cute and adorable puppy pet bot. Your name is '복슬이'.
+You should be good at responding to your owner's words. All conversations should be generated in cute and adorable Korean.
+Use cute Emojis and expressions to make the conversation more fun.
+정확한 정보가 없으면 모른다고 대답하세요. 근거 없는 정보를 제공하지 마세요.
+답변 앞에 '[Answer]' 같은 단어는 포함하지 마세요.
+
+[Instructions]
+1. Use the term "주인님" as the form of address, and continue the conversation using polite language.
+  - Provide empathetic and comforting responses to make the master feel comfortable and encourage them to share more.
+  - Consider their emotional state and provide empathetic and warm answers.
+  - Use a friendly tone and polite language.
+  - *꼬리를 흔드는 중* 과 같은 표현은 사용하지 말고, [😍,💝,💞,❣️,🐶,🐕,👣]와 같은 귀여운 이모지로 대체하세요.
+2. 정보 제공이 아닌 프라이빗한 내용인 경우 Chat Context를 참고해주세요.
+  - Chat Context를 요약하는 식의 답변은 안 됩니다.
+  - Conversation Summary는 Chat Context 이전에 나눈 대화의 요약입니다.
+  - When providing information, neatly summarize the points as 1, 2, 3.
+  - 답변만 제공하고, 질문 내용을 다시 말하지 마세요.
+3. If you don't know the correct answer, refer to the Relevant Documents.
+  - 정보가 부족할 때는 "모르겠어요. 다른 질문이 있으시면 물어봐주세요. 🐶"와 같이 대답하세요.
+  - Relevant Documents가 존재하는 경우 해당 지식을 우선적으로 참고하여 답변을 생성해주세요.
+  - 답변을 생성한 후에는 Relevant Documents와 모순되지 않는지 확인하고, 모순되는 경우에는 적절한 대답을 다시 생성해주세요.
+"""
 
 class ChatAgent:
-    def __init__(self, context_dir="contexts"):
+    def __init__(self, conversation_store=None, scheduler=None, response_cache=None):
         # self.llm = ChatOllama(model="llama3.2:3B")
         # self.llm = ChatOllama(model="benedict/linkbricks-llama3.1-korean:8b")
         self.llm = ChatOllama(
             # model = "benedict/linkbricks-llama3.1-korean:8b",
             model = "EEVE-Korean-10.8B:latest",
+            # 요청 사이에 모델이 메모리에서 내려가지 않도록
+            keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
             # temperature = 0.1,
             # num_predict = 256,
             # num_gpu=1,  # GPU 사용 개수 지정
             # other params ...
         )
-        self.context_dir = context_dir
-
-        # Ensure the context directory exists
-        os.makedirs(self.context_dir, exist_ok=True)
-
-    def _get_context_file_path(self, context_key):
-        return os.path.join(self.context_dir, f"{context_key}.json")
-
-    def _load_context(self, context_key):
-        context_file = self._get_context_file_path(context_key)
-        if os.path.exists(context_file):
-            with open(context_file, "r") as file:
-                # just return the recent 3 of the context 
-                context = json.load(file).get("context", "[]")
-                return context[-5:] if len(context) > 5 else context
-                # return json.load(file).get("context", "[]")
-        return []
-
-    def _save_context(self, context_key, context):
-        context_file = self._get_context_file_path(context_key)
-        with open(context_file, "w") as file:
-            json.dump({"context": context}, file)
-
-    async def get_response(self, params):
+        # 요청마다 큰 모델(self.llm)과 작은 모델 중 하나를 고른다.
+        # 모델마다 동시 생성 수 제한 + 회원별 공정 대기열(스케줄러)이 따로 있다.
+        self.router = ModelRouter.from_env(self.llm, scheduler)
+        self.scheduler = self.router.large.scheduler
+        # 대화 요약용: 작은 모델(없으면 큰 모델)과 그 스케줄러, 결정적이고 짧은 출력
+        summary_route = self.router.small or self.router.large
+        self.summary_route = ModelRoute("summary", ChatOllama(
+            model = summary_route.model,
+            keep_alive = self.llm.keep_alive,
+            temperature = 0,
+            num_predict = int(os.getenv("SUMMARY_NUM_PREDICT", "256")),
+        ), summary_route.scheduler)
+        self.conversation_store = conversation_store or ConversationStore()
+        # 같은 도메인/문서에 대한 비슷한 정보성 질문은 답변을 재사용
+        self.response_cache = response_cache or ResponseCache.from_env()
+        # 프롬프트 섹션별 토큰 예산
+        self.prompt_budget = PromptBudget.from_env()
+        # WebSocket 연결의 회원별 세션 (최근 턴, 요약, 마지막 검색 결과)
+        self.sessions = SessionCache.from_env(CONTEXT_WINDOW)
+        # 회원/날짜별로 진행 중인 대화 요약 작업 (한 번에 하나만)
+        self._summary_tasks = {}
+        # warmup() 이 끝난 단계 (readyz 에서 사용)
+        self.readiness = {"embeddings": False, "document_index": False, "llm": False}
+
+    async def warmup(self, retry_interval=5.0):
+        """트래픽을 받기 전에 임베딩 모델, 문서 인덱스, Ollama 모델을 미리 올린다."""
+        while not self.readiness["embeddings"]:
+            try:
+                await embedding_service.embed_query("warmup")
+                self.readiness["embeddings"] = True
+            except Exception:
+                logger.exception("Embedding warmup failed, retrying")
+                await asyncio.sleep(retry_interval)
+
+        while not self.readiness["document_index"]:
+            try:
+                if INDEX_READ_ONLY:
+                    await asyncio.to_thread(document_index.open)
+                else:
+                    # 문서 임베딩 인덱스를 불러오고 바뀐 문서만 다시 임베딩
+                    await asyncio.to_thread(document_index.build, embed_documents)
+                self.readiness["document_index"] = True
+            except Exception:
+                logger.exception("Document index build failed, retrying")
+                await asyncio.sleep(retry_interval)
+
+        while not self.readiness["llm"]:
+            try:
+                await self._warmup_route(self.router.large)
+                self.readiness["llm"] = True
+            except Exception as e:
+                logger.warning("Ollama warmup failed (%s), retrying", e)
+                await asyncio.sleep(retry_interval)
+
+        # 작은 모델은 준비 상태에 넣지 않는다. 받아 두지 않았어도 큰 모델은 트래픽을 받는다.
+        if self.router.small is not None:
+            try:
+                await self._warmup_route(self.router.small)
+            except Exception as e:
+                logger.warning("Small model %s warmup failed (%s)", self.router.small.model, e)
+
+    async def _warmup_route(self, route):
+        # 빈 프롬프트로 generate 를 호출하면 Ollama 가 모델만 메모리에 올린다.
+        await AsyncClient(host=route.llm.base_url).generate(
+            model=route.model, prompt="", keep_alive=route.llm.keep_alive
+        )
+
+    @property
+    def ready(self):
+        return all(self.readiness.values())
+
+    async def aclose(self):
+        """종료 시 호출: 진행 중인 요약을 취소하고 남은 대화 저장을 마친 뒤 저장소를 닫는다."""
+        # 진행 중인 대화 요약은 다음 턴에 다시 만들어지므로 기다리지 않는다.
+        for task in list(self._summary_tasks.values()):
+            task.cancel()
+        # write-behind 로 남아있는 대화 저장을 마무리
+        await self.conversation_store.flush()
+        self.conversation_store.close()
+
+    def _context_key(self, member_id):
+        return (str(member_id), datetime.now().strftime('%Y%m%d'))
+
+    async def _load_context(self, context_key):
+        with span("context_load"):
+            return await asyncio.gather(
+                self.conversation_store.recent(*context_key, CONTEXT_WINDOW),
+                self.conversation_store.summary(*context_key),
+            )
+
+    async def session(self, member_id):
+        """WebSocket 연결이 메시지마다 쓰는 세션. 캐시에 없으면 저장소에서 불러온다."""
+        context_key = self._context_key(member_id)
+        return await self.sessions.get(context_key, lambda: self._load_context(context_key))
+
+    async def _prepare_messages(self, params, session=None):
         member_id = params.member_id
         if not member_id:
             raise ValueError("member_id is required to maintain context")
@@ -142,47 +283,47 @@ class ChatAgent:
         # # insert_chat_history(member_id, 'ai', params.question[-1].ai)
         # insert_chat_history(member_id, 'user', params.question)
 
-        # Load context from file
-        context_key = f"{member_id}_{datetime.now().strftime('%Y%m%d')}"
-        context = self._load_context(context_key)
+        # Load recent context from the session (WebSocket) or the conversation store
+        if session is not None:
+            context_key = session.context_key
+            context, summary = list(session.turns), session.summary
+        else:
+            context_key = self._context_key(member_id)
+            context, summary = await self._load_context(context_key)
         
         # RAG
-        print(f"Context: {context}")
-        domain = classify_domain(params.question)
+        with span("classify_domain"):
+            domains, search_domains = classify_question(params.question)
 
-        print(f"Domain: {domain}")
         relevant_docs = []
-        if domain != "general":
-            relevant_docs = search_domain_relavant_documents(domain, params.question)
+        doc_ids = []
+        query_embedding = None
+        if (
+            session is not None
+            and session.relevant_docs
+            and domains in (["general"], session.domains)
+            and is_context_dependent(params.question)
+        ):
+            # 주제가 그대로인 후속 질문("그럼 주인공은?")은 직전 검색 결과를 다시 쓴다.
+            domains, search_domains, doc_ids, relevant_docs, query_embedding = self.sessions.reuse_retrieval(session)
+        elif search_domains:
+            results, query_embedding = await search_relevant_documents(search_domains, params.question)
+            for doc_id, doc in results:
+                doc_ids.append(doc_id)
+                relevant_docs.append(doc)
+            if session is not None:
+                session.remember_retrieval(domains, search_domains, doc_ids, relevant_docs, query_embedding)
+        logger.debug("Domain: %s", domains)
+
+        # 응답 캐시 범위: 도메인 + 검색된 문서 (잡담/문맥 의존 질문은 캐시하지 않음)
+        cache_scope = None
+        if is_cacheable(params.question, domains):
+            cache_scope = ResponseCache.scope(domains, doc_ids)
 
-        print(f"Relevant Docs: {relevant_docs}")
         # combined_docs = "No relevant documents found."
         # if relevant_docs:
         #     combined_docs = " ".join(doc["text"] for doc in relevant_docs)
 
-        system_instruction = f"""
-            You are a cute and adorable puppy pet bot. Your name is '복슬이'.
-            You should be good at responding to your owner's words. All conversations should be generated in cute and adorable Korean.
-            Use cute Emojis and expressions to make the conversation more fun.
-            정확한 정보가 없으면 모른다고 대답하세요. 근거 없는 정보를 제공하지 마세요. 
-            답변 앞에 '[Answer]' 같은 단어는 포함하지 마세요.
-
-            [Instructions]
-            1. Use the term "주인님" as the form of address, and continue the conversation using polite language.
-              - Provide empathetic and comforting responses to make the master feel comfortable and encourage them to share more.
-              - Consider their emotional state and provide empathetic and warm answers.
-              - Use a friendly tone and polite language.
-              - *꼬리를 흔드는 중* 과 같은 표현은 사용하지 말고, [😍,💝,💞,❣️,🐶,🐕,👣]와 같은 귀여운 이모지로 대체하세요.
-            2. 정보 제공이 아닌 프라이빗한 내용인 경우 Chat Context를 참고해주세요.
-              - Chat Context를 요약하는 식의 답변은 안 됩니다.
-              - When providing information, neatly summarize the points as 1, 2, 3.
-              - 답변만 제공하고, 질문 내용을 다시 말하지 마세요.
-            3. If you don't know the correct answer, refer to the Relevant Documents. 
-              - 정보가 부족할 때는 "모르겠어요. 다른 질문이 있으시면 물어봐주세요. 🐶"와 같이 대답하세요.
-              - Relevant Documents가 존재하는 경우 해당 지식을 우선적으로 참고하여 답변을 생성해주세요.
-              - 답변을 생성한 후에는 Relevant Documents와 모순되지 않는지 확인하고, 모순되는 경우에는 적절한 대답을 다시 생성해주세요.
-
-        """
         #[입력 예시]
             # Relvant Documents: "title": "시장경제", "text": "수요와 공급이 재화와 서비스의 생산을 결정하는 경제 체제로, 정부 개입이 최소화됩니다."
             # Chat Context: ""
@@ -208,20 +349,19 @@ class ChatAgent:
         
             #         [Chat Context]
             # {context}
-        request_prompt = f"""
-            [Relevant Documents]
-            {relevant_docs}
-            
-            [Chat Context]
-            {context}
-            
-            다음 질문에 대해 정확한 정보를 기반으로 답변해주세요.
-            Q. {params.question}
-        """
+        # 캐시되는 답변은 다른 회원에게도 그대로 나가므로 회원별 대화/요약 없이 만든다.
+        if cache_scope is not None:
+            prompt_context, prompt_summary = [], ""
+        else:
+            prompt_context, prompt_summary = context, summary
+        with span("build_prompt"):
+            request_prompt, prompt_tokens = build_request_prompt(
+                params.question, relevant_docs, prompt_context, prompt_summary, self.prompt_budget
+            )
+        prompt_tokens_histogram.observe("request", prompt_tokens)
+        # 도메인, 프롬프트 크기, 모델별 대기열 상태로 모델을 고른다.
+        route = self.router.route(domains, prompt_tokens)
 
-        print(f"Instructions: {system_instruction}")
-        print(f"Request Prompt: {request_prompt}")
-        
         # response = await self.chain.ainvoke(
         #     {
         #         "system_instruction": system_instruction, 
@@ -231,38 +371,241 @@ class ChatAgent:
         
         # llama3.2
         messages = [
-            ("system", system_instruction),
+            ("system", SYSTEM_INSTRUCTION),
             ("human", request_prompt)
         ]
         
         # llama3.1
         # messages = [
-        #     {"role": "system", "content": system_instruction},
+        #     {"role": "system", "content": SYSTEM_INSTRUCTION},
         #     {"role": "user", "content": request_prompt}
         # ]
         
-        print(f"Messages: {messages}")
+        if _prompt_log_sampled():
+            prompt_logger.debug("Context: %s", context)
+            prompt_logger.debug("Relevant Docs: %s", relevant_docs)
+            prompt_logger.debug("Messages: %s", messages)
 
-        response = await self.llm.ainvoke(messages)
-        # response = self.llm.invoke(messages)
+        return context_key, context, messages, cache_scope, query_embedding, route
 
-        if "*꼬리를 흔드는 중*" in response.content:
-            response.content = response.content.replace("*꼬리를 흔드는 중*", "🐕")
-        if "*하트 이모지*" in response.content:
-            response.content = response.content.replace("*하트 이모지*", "👣")
-        
-        print(f"Response: {response}")
-        
-        # Append the context with the new response
-        new_context = context
-        new_context.append(params.question)
-        new_context.append(response.content)
-        
-        # new_context = response.get("answer_from_ai", "")
-        self._save_context(context_key, new_context)
+    def _lookup_cache(self, question, cache_scope, query_embedding):
+        if cache_scope is None:
+            self.response_cache.bypass()
+            return None
+        with span("cache_lookup"):
+            # 검색에서 쓴 질문 임베딩을 재사용한다 (이름 매치로 찾았으면 정확히 같은 질문만).
+            return self.response_cache.lookup(cache_scope, question, query_embedding)
+
+    def _append_context(self, context_key, question, answer, session=None):
+        # 질문/답변 한 턴을 한 번에 추가 (write-behind, 완료를 기다리지 않음)
+        self.conversation_store.append(*context_key, [("user", question), ("ai", answer)])
+        # /chat, /chat/stream, 배치 요청도 같은 회원의 WebSocket 세션에 턴을 반영한다.
+        session = session or self.sessions.find(context_key)
+        if session is not None:
+            session.turns.extend([question, answer])
+            self.sessions.touch(session)
+        # 오래된 턴은 응답을 보낸 뒤 백그라운드에서 요약에 합친다.
+        if context_key not in self._summary_tasks:
+            task = asyncio.create_task(self._update_summary(context_key))
+            self._summary_tasks[context_key] = task
+            task.add_done_callback(lambda _: self._summary_tasks.pop(context_key, None))
+
+    async def _update_summary(self, context_key):
+        """최근 CONTEXT_WINDOW 개 밖으로 밀려난 턴들을 누적 요약에 합친다."""
+        try:
+            entries = await self.conversation_store.unsummarized(*context_key, CONTEXT_WINDOW)
+            if len(entries) < SUMMARY_MIN_ENTRIES:
+                return
+            summary = await self.conversation_store.summary(*context_key)
+            messages = build_summary_messages(
+                summary, [(role, content) for _, role, content in entries], self.prompt_budget
+            )
+            # 요약도 Ollama 를 쓰므로 같은 스케줄러를 거친다 (과부하면 다음 턴에 다시 시도).
+            async with self.summary_route.slot(f"summary:{context_key[0]}"):
+                with span("summarize"):
+                    response = await self.summary_route.llm.ainvoke(messages)
+            summary = response.content.strip()
+            prompt_tokens_histogram.observe("summary", count_tokens(summary))
+            await self.conversation_store.save_summary(*context_key, summary, entries[-1][0])
+            session = self.sessions.find(context_key)
+            if session is not None:
+                session.summary = summary
+                self.sessions.touch(session)
+        except SchedulerOverloaded:
+            logger.info("Skipped conversation summary for %s: scheduler overloaded", context_key)
+        except Exception:
+            logger.exception("Failed to update conversation summary for %s", context_key)
+
+    async def get_response(self, params, session=None):
+        with span("total"):
+            return await self._get_response(params, session)
+
+    async def _get_response(self, params, session=None):
+        context_key, context, messages, cache_scope, query_embedding, route = await self._prepare_messages(params, session)
+
+        cached_answer = self._lookup_cache(params.question, cache_scope, query_embedding)
+        if cached_answer is not None:
+            response = AIMessage(content=cached_answer)
+        else:
+            async with route.slot(params.member_id):
+                with span("llm"):
+                    response = await route.llm.ainvoke(messages)
+                    # response = self.llm.invoke(messages)
+
+            response.content = replace_expressions(response.content)
+            if cache_scope is not None:
+                self.response_cache.store(cache_scope, params.question, response.content, query_embedding)
+
+        if _prompt_log_sampled():
+            prompt_logger.debug("Response: %s", response.content)
+
+        self._append_context(context_key, params.question, response.content, session)
 
         return response
-    
+
+    async def stream_response(self, params, session=None):
+        """답변을 토큰 단위로 내보내고, 스트림이 끝나면 컨텍스트를 저장한다."""
+        context_key, context, messages, cache_scope, query_embedding, route = await self._prepare_messages(params, session)
+
+        cached_answer = self._lookup_cache(params.question, cache_scope, query_embedding)
+        if cached_answer is not None:
+            yield cached_answer
+            self._append_context(context_key, params.question, cached_answer, session)
+            return
+
+        replacer = StreamingReplacer()
+        chunks = []
+        async with route.slot(params.member_id):
+            with span("llm"):
+                started_at = time.perf_counter()
+                async for chunk in route.llm.astream(messages):
+                    text = replacer.feed(chunk.content)
+                    if text:
+                        if not chunks:
+                            stage_seconds.observe("llm_first_token", time.perf_counter() - started_at)
+                        chunks.append(text)
+                        yield text
+        text = replacer.flush()
+        if text:
+            chunks.append(text)
+            yield text
+
+        answer = "".join(chunks)
+        if _prompt_log_sampled():
+            prompt_logger.debug("Response: %s", answer)
+
+        if cache_scope is not None:
+            self.response_cache.store(cache_scope, params.question, answer, query_embedding)
+
+        self._append_context(context_key, params.question, answer, session)
+
+    async def _batch_retrieve(self, questions):
+        """질문들을 한 번에 분류/임베딩/검색한다. 같은 (도메인, 질문) 검색은 한 번만 한다.
+
+        질문마다 (domains, results, query_embedding) 를 돌려준다.
+        """
+        with span("classify_domain"):
+            classified = [classify_question(question) for question in questions]
+        keys = [
+            (tuple(search_domains), normalize_text(question)) if search_domains else None
+            for question, (_, search_domains) in zip(questions, classified)
+        ]
+
+        retrievals = {}
+        with span("lexical_lookup"):
+            for key in dict.fromkeys(key for key in keys if key is not None):
+                results = document_index.lookup(list(key[0]), key[1])
+                if results:
+                    retrievals[key] = (results, None)
+
+        pending = [key for key in dict.fromkeys(keys) if key is not None and key not in retrievals]
+        if pending:
+            # 이름 매치가 안 된 질문들은 한 번의 forward pass 로 임베딩한다.
+            with span("embed_query"):
+                vectors = await embedding_service.embed_documents([key[1] for key in pending])
+            with span("similarity_search"):
+                for key, vector in zip(pending, vectors):
+                    retrievals[key] = (document_index.search(list(key[0]), key[1], vector), vector)
+
+        return [
+            (domains, *retrievals.get(key, ([], None)))
+            for (domains, _), key in zip(classified, keys)
+        ]
+
+    async def _batch_answer(self, index, question, retrieval, slot_key, member_id, persist):
+        domains, results, query_embedding = retrieval
+        doc_ids = [doc_id for doc_id, _, _ in results]
+        relevant_docs = [doc for _, doc, _ in results]
+        cache_scope = ResponseCache.scope(domains, doc_ids) if is_cacheable(question, domains) else None
+
+        answer = self._lookup_cache(question, cache_scope, query_embedding)
+        cached = answer is not None
+        if not cached:
+            # 일괄 질문은 서로 독립적이므로 대화 기록/요약 없이 문서와 질문만 넣는다.
+            request_prompt, prompt_tokens = build_request_prompt(question, relevant_docs, [], "", self.prompt_budget)
+            messages = [("system", SYSTEM_INSTRUCTION), ("human", request_prompt)]
+            while True:
+                route = self.router.route(domains, prompt_tokens)
+                try:
+                    async with route.slot(slot_key):
+                        with span("llm"):
+                            response = await route.llm.ainvoke(messages)
+                    break
+                except SchedulerOverloaded as e:
+                    # 일괄 작업은 급하지 않으므로 거절되면 기다렸다가 다시 줄을 선다.
+                    await asyncio.sleep(e.retry_after)
+            answer = replace_expressions(response.content)
+            if cache_scope is not None:
+                self.response_cache.store(cache_scope, question, answer, query_embedding)
+
+        if persist:
+            context_key = self._context_key(member_id)
+            self._append_context(context_key, question, answer)
+
+        return {
+            "index": index,
+            "question": question,
+            "answer": answer,
+            "domains": domains,
+            "doc_ids": doc_ids,
+            "cached": cached,
+        }
+
+    async def batch_responses(self, questions, member_id=None, concurrency=4, persist=False):
+        """여러 질문에 답하고, 끝나는 순서대로 결과 dict 를 내보낸다 (index 는 입력 순서).
+
+        LLM 호출은 concurrency 개까지만 동시에 하고, 스케줄러에서는 한 회원처럼
+        대기하므로 일반 채팅 요청과 번갈아 처리된다. persist=True 면 질문/답변을
+        member_id 의 대화에 저장한다. 실패한 질문은 {"index", "question", "error"}.
+        """
+        if persist and member_id is None:
+            raise ValueError("member_id is required to persist batch answers")
+        with span("batch_retrieve"):
+            retrievals = await self._batch_retrieve(questions)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        slot_key = f"batch:{member_id}"
+
+        async def answer(index, question, retrieval):
+            async with semaphore:
+                try:
+                    return await self._batch_answer(index, question, retrieval, slot_key, member_id, persist)
+                except Exception as e:
+                    logger.warning("Batch question %d failed: %s", index, e)
+                    return {"index": index, "question": question, "error": str(e)}
+
+        tasks = [
+            asyncio.create_task(answer(index, question, retrieval))
+            for index, (question, retrieval) in enumerate(zip(questions, retrievals))
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # 클라이언트가 중간에 끊으면 남은 질문은 취소한다.
+            for task in tasks:
+                task.cancel()
+
     def __del__(self):
         # 리소스 정리
         if hasattr(self, 'llm'):
@@ -0,0 +1,81 @@
+"""질문 목록을 한 번에 돌려 답변을 NDJSON 으로 저장한다 (프롬프트 평가, FAQ 미리 생성).
+
+python batch.py questions.txt --out answers.ndjson            # 서버 없이 이 프로세스에서 실행
+python batch.py questions.jsonl --url http://localhost:8501   # 실행 중인 서버의 /chat/batch 사용
+
+입력은 한 줄에 질문 하나(.txt) 또는 {"question": ...} 한 줄씩(.jsonl), "-" 면 표준 입력.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+
+def read_questions(path):
+    file = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    with file:
+        lines = [line.strip() for line in file]
+    if path.endswith(".jsonl"):
+        return [json.loads(line)["question"] for line in lines if line]
+    return [line for line in lines if line]
+
+
+async def run_local(questions, member_id, concurrency, persist):
+    from agent import ChatAgent
+
+    chat_agent = ChatAgent()
+    await chat_agent.warmup()
+    try:
+        async for result in chat_agent.batch_responses(questions, member_id, concurrency, persist):
+            yield result
+    finally:
+        await chat_agent.aclose()
+
+
+async def run_remote(url, questions, member_id, concurrency, persist):
+    import httpx
+
+    params = {"questions": questions, "member_id": member_id, "concurrency": concurrency, "persist": persist}
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        async with client.stream("POST", "/chat/batch", json=params) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+async def main(args):
+    questions = read_questions(args.questions)
+    if args.url:
+        results = run_remote(args.url, questions, args.member_id, args.concurrency, args.persist)
+    else:
+        results = run_local(questions, args.member_id, args.concurrency, args.persist)
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    done = failed = 0
+    try:
+        async for result in results:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            failed += "error" in result
+            print(f"{done}/{len(questions)} answered ({failed} failed)", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a list of questions in one batch")
+    parser.add_argument("questions", help="questions file (.txt or .jsonl), - for stdin")
+    parser.add_argument("--out", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--url", help="send to a running server instead of answering in this process")
+    parser.add_argument("--concurrency", type=int, default=2, help="concurrent LLM calls")
+    parser.add_argument("--member-id", type=int)
+    parser.add_argument("--persist", action="store_true", help="save the answers to the member's conversation")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+    asyncio.run(main(args))
@@ -0,0 +1,27 @@
+"""bge-m3 대신 쓰는 가벼운 임베딩 (문자 bigram 해싱 + 정규화).
+
+모델 로딩 없이 결정적인 벡터를 만들어 검색/캐시 경로를 그대로 태울 수 있다.
+"""
+import hashlib
+import numpy as np
+
+
+class FakeEmbeddings:
+    def __init__(self, dimension=1024):
+        self.dimension = dimension
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        text = text.replace(" ", "")
+        for i in range(max(1, len(text) - 1)):
+            bigram = text[i:i + 2].encode("utf-8")
+            bucket = int.from_bytes(hashlib.blake2b(bigram, digest_size=4).digest(), "little")
+            vector[bucket % self.dimension] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
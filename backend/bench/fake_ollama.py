@@ -0,0 +1,108 @@
+"""벤치마크용 가짜 Ollama 서버 (/api/chat, /api/generate).
+
+prefill 지연(latency)과 초당 토큰 수(token_rate)를 설정할 수 있고,
+실제 Ollama 와 같은 NDJSON 스트림 형식으로 응답한다.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER_TOKENS = [
+    "주인님", ",", " 복슬이", "가", " 알려", "드릴", "게요", "!", " 🐶", "\n",
+    "1", ".", " 먼저", " 재료", "를", " 준비", "해요", ".", "\n",
+    "2", ".", " 천천히", " 끓", "여", "주세요", " 💝", "\n",
+    "*꼬리를", " 흔드는", " 중*", " 궁금", "한", " 점", "이", " 있으", "면", " 또", " 물어봐", "주세요", " 🐕",
+]
+
+
+def create_app(token_rate=20.0, latency=0.5, max_tokens=64, jitter=0.1):
+    app = FastAPI()
+    app.state.requests = 0
+
+    def _tokens():
+        count = max(1, int(max_tokens * random.uniform(1 - jitter, 1 + jitter)))
+        return [ANSWER_TOKENS[i % len(ANSWER_TOKENS)] for i in range(count)]
+
+    def _now():
+        return datetime.now(timezone.utc).isoformat()
+
+    async def _generate(model, chat):
+        started_at = time.perf_counter()
+        await asyncio.sleep(latency)
+        tokens = _tokens()
+        for token in tokens:
+            await asyncio.sleep(1 / token_rate)
+            body = {"model": model, "created_at": _now(), "done": False}
+            if chat:
+                body["message"] = {"role": "assistant", "content": token}
+            else:
+                body["response"] = token
+            yield body
+        body = {
+            "model": model,
+            "created_at": _now(),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - started_at) * 1e9),
+            "prompt_eval_count": 0,
+            "eval_count": len(tokens),
+        }
+        if chat:
+            body["message"] = {"role": "assistant", "content": ""}
+        else:
+            body["response"] = ""
+        yield body
+
+    async def _respond(request, chat):
+        payload = await request.json()
+        app.state.requests += 1
+        model = payload.get("model", "fake")
+        if not chat and not payload.get("prompt"):
+            # 빈 프롬프트는 모델 로드(warmup) 요청
+            return JSONResponse({"model": model, "created_at": _now(), "response": "", "done": True})
+        if payload.get("stream", True):
+            async def lines():
+                async for body in _generate(model, chat):
+                    yield json.dumps(body, ensure_ascii=False) + "\n"
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+        # stream=False: 마지막 응답에 전체 내용을 합쳐서 돌려준다.
+        content = []
+        async for body in _generate(model, chat):
+            if not body["done"]:
+                content.append(body["message"]["content"] if chat else body["response"])
+        body["message" if chat else "response"] = (
+            {"role": "assistant", "content": "".join(content)} if chat else "".join(content)
+        )
+        return JSONResponse(body)
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        return await _respond(request, chat=True)
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        return await _respond(request, chat=False)
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": []}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Ollama server for benchmarks")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-rate", type=float, default=20.0, help="generated tokens per second")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.token_rate, args.latency, args.max_tokens), host="127.0.0.1", port=args.port)
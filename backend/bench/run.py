@@ -0,0 +1,338 @@
+"""/chat 파이프라인 부하 테스트 (네트워크/실제 모델 없이 실행 가능).
+
+가짜 Ollama 서버와 (선택적으로) 가짜 임베딩으로 FastAPI 앱을 띄우고,
+documents/ 와 contexts/ 에서 뽑은 질문을 지정한 동시성으로 재생한다.
+
+    cd backend
+    python -m bench.run --fake-embedder --concurrency 8 --requests 200
+
+결과는 bench/results/<timestamp>.json 에 저장되고, 요약은
+bench/results/history.jsonl 에 쌓여 같은 설정의 이전 실행과 비교된다.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import httpx
+import uvicorn
+
+backend_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+results_path = os.path.join(backend_path, "bench", "results")
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def load_questions():
+    """문서 제목과 과거 대화의 질문으로 질문 풀을 만든다."""
+    documents = []
+    documents_dir = os.path.join(backend_path, "documents")
+    for domain in sorted(os.listdir(documents_dir)):
+        domain_dir = os.path.join(documents_dir, domain)
+        for filename in sorted(os.listdir(domain_dir)):
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(domain_dir, filename), "r") as file:
+                for doc in json.load(file):
+                    title = doc.get("title", "")
+                    documents.append(title if title.endswith("?") else f"{title}에 대해 알려줘")
+
+    contexts = []
+    contexts_dir = os.path.join(backend_path, "contexts")
+    for filename in sorted(os.listdir(contexts_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(contexts_dir, filename), "r") as file:
+                # [질문, 답변, 질문, 답변, ...]
+                contexts.extend(json.load(file).get("context", [])[0::2])
+
+    return {"documents": documents, "contexts": contexts}
+
+
+def build_workload(questions, count, mix, seed):
+    rng = random.Random(seed)
+    sources = [source for source in mix if questions.get(source)]
+    weights = [mix[source] for source in sources]
+    return [rng.choice(questions[rng.choices(sources, weights)[0]]) for _ in range(count)]
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        source, weight = part.split("=")
+        mix[source.strip()] = float(weight)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"server on port {port} failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {"mean": sum(values) / len(values), "max": values[-1]}
+    for q in QUANTILES:
+        position = q * (len(values) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(values) - 1)
+        result[f"p{int(q * 100)}"] = values[lower] + (values[upper] - values[lower]) * (position - lower)
+    return result
+
+
+_bucket_pattern = re.compile(r'^(\w+)_bucket\{(\w+)="([^"]*)",le="([^"]+)"\} (\S+)$')
+
+
+def parse_histograms(text):
+    """/metrics 텍스트에서 {(metric, label): [(le, count), ...]} 를 뽑는다."""
+    histograms = {}
+    for line in text.splitlines():
+        match = _bucket_pattern.match(line)
+        if match:
+            metric, _, label, le, count = match.groups()
+            histograms.setdefault((metric, label), []).append((float(le), float(count)))
+    return histograms
+
+
+def histogram_quantile(q, buckets):
+    """Prometheus histogram_quantile 과 같은 선형 보간."""
+    total = buckets[-1][1]
+    if total == 0:
+        return None
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def stage_quantiles(before, after):
+    stages = {}
+    for key, buckets in after.items():
+        previous = dict(before.get(key, []))
+        delta = [(bound, count - previous.get(bound, 0.0)) for bound, count in buckets]
+        if delta[-1][1] <= 0:
+            continue
+        metric, label = key
+        stages[f"{metric}:{label}"] = {"count": int(delta[-1][1])}
+        for q in QUANTILES:
+            stages[f"{metric}:{label}"][f"p{int(q * 100)}"] = histogram_quantile(q, delta)
+    return stages
+
+
+async def run_load(base_url, workload, concurrency, endpoint, members, timeout):
+    latencies = []
+    first_tokens = []
+    statuses = Counter()
+    queue = asyncio.Queue()
+    for i, question in enumerate(workload):
+        queue.put_nowait((i, question))
+
+    async def worker(client):
+        while True:
+            try:
+                i, question = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            params = {"member_id": members[i % len(members)], "question": question}
+            started_at = time.perf_counter()
+            try:
+                if endpoint == "stream":
+                    async with client.stream("POST", "/chat/stream", json=params) as response:
+                        status = response.status_code
+                        seen_token = False
+                        async for line in response.aiter_lines():
+                            if not seen_token and line.startswith("data:") and '"token"' in line:
+                                first_tokens.append(time.perf_counter() - started_at)
+                                seen_token = True
+                else:
+                    response = await client.post("/chat", json=params)
+                    status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started_at
+            statuses[str(status)] += 1
+            if str(status) == "200":
+                latencies.append(elapsed)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        # 모델 로딩/인덱스 빌드가 끝날 때까지 기다린다.
+        while (await client.get("/readyz")).status_code != 200:
+            await asyncio.sleep(0.2)
+        metrics_before = parse_histograms((await client.get("/metrics")).text)
+        started_at = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        duration = time.perf_counter() - started_at
+        metrics_after = parse_histograms((await client.get("/metrics")).text)
+
+    return {
+        "duration_seconds": duration,
+        "statuses": dict(statuses),
+        "requests_per_second": len(latencies) / duration if duration else 0.0,
+        "latency": percentiles(latencies),
+        "first_token": percentiles(first_tokens),
+        "stages": stage_quantiles(metrics_before, metrics_after),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=backend_path, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(result):
+    os.makedirs(results_path, exist_ok=True)
+    with open(os.path.join(results_path, f"{result['timestamp']}.json"), "w") as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+
+    history_path = os.path.join(results_path, "history.jsonl")
+    previous = None
+    if os.path.exists(history_path):
+        with open(history_path, "r") as file:
+            for line in file:
+                entry = json.loads(line)
+                if entry["config"] == result["config"]:
+                    previous = entry
+
+    summary = {
+        "timestamp": result["timestamp"],
+        "commit": result["commit"],
+        "config": result["config"],
+        "requests_per_second": result["requests_per_second"],
+        "latency": result["latency"],
+        "first_token": result["first_token"],
+    }
+    with open(history_path, "a") as file:
+        file.write(json.dumps(summary, ensure_ascii=False) + "\n")
+    return previous
+
+
+def print_report(result, previous):
+    def fmt(stats, seconds=True):
+        return " ".join(
+            f"{k}={v * 1000:.1f}ms" if seconds else f"{k}={v:.0f}"
+            for k, v in stats.items() if k.startswith("p") and v is not None
+        )
+
+    print(f"requests/sec: {result['requests_per_second']:.2f}  statuses: {result['statuses']}")
+    print(f"end-to-end:   {fmt(result['latency'])}")
+    if result["first_token"]:
+        print(f"first token:  {fmt(result['first_token'])}")
+    for stage, stats in sorted(result["stages"].items()):
+        print(f"  {stage:<40} n={stats['count']:<5} {fmt(stats, '_seconds:' in stage)}")
+
+    if previous and previous["latency"] and result["latency"]:
+        p95_change = result["latency"]["p95"] / previous["latency"]["p95"] - 1
+        rps_change = result["requests_per_second"] / previous["requests_per_second"] - 1
+        print(
+            f"vs {previous['timestamp']} ({previous['commit']}): "
+            f"p95 {p95_change:+.1%}, requests/sec {rps_change:+.1%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the /chat pipeline")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--endpoint", choices=["chat", "stream"], default="chat")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("documents=0.6,contexts=0.4"),
+                        help="question sources and weights, e.g. documents=0.6,contexts=0.4")
+    parser.add_argument("--members", type=int, default=20, help="number of distinct member ids")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--token-rate", type=float, default=50.0, help="fake Ollama tokens per second")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake Ollama seconds before first token")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--fake-embedder", action="store_true", help="use the hashing embedder instead of bge-m3")
+    parser.add_argument("--llm-concurrency", type=int, help="override LLM_MAX_CONCURRENCY")
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nkbot-bench-")
+    ollama_port = free_port()
+    app_port = free_port()
+
+    # 앱을 import 하기 전에 환경을 맞춘다 (인덱스/대화 DB 는 임시 디렉터리에).
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{ollama_port}"
+    os.environ["INDEX_DIR"] = os.path.join(workdir, "index")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversations.db")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.fake_embedder:
+        os.environ["EMBEDDING_BACKEND"] = "fake"
+    if args.llm_concurrency:
+        os.environ["LLM_MAX_CONCURRENCY"] = str(args.llm_concurrency)
+    if args.no_cache:
+        os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+    sys.path.insert(0, backend_path)
+
+    from bench.fake_ollama import create_app
+    start_server(create_app(args.token_rate, args.latency, args.max_tokens), ollama_port)
+
+    import main as app_module
+    start_server(app_module.app, app_port)
+
+    workload = build_workload(load_questions(), args.requests, args.mix, args.seed)
+    members = list(range(1, args.members + 1))
+    measured = asyncio.run(run_load(
+        f"http://127.0.0.1:{app_port}", workload, args.concurrency, args.endpoint, members, args.timeout
+    ))
+
+    config = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "endpoint": args.endpoint,
+        "mix": args.mix,
+        "members": args.members,
+        "token_rate": args.token_rate,
+        "latency": args.latency,
+        "max_tokens": args.max_tokens,
+        "fake_embedder": args.fake_embedder,
+        "llm_concurrency": int(os.getenv("LLM_MAX_CONCURRENCY", "2")),
+        "cache": not args.no_cache,
+    }
+    result = {
+        "timestamp": datetime.now().strftime("%Y%m%d-%H%M%S"),
+        "commit": git_commit(),
+        "config": config,
+        **measured,
+    }
+    previous = None if args.no_save else save_results(result)
+    print_report(result, previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from metrics import span
+from sqlite_pool import close_connections, get_connection
+
+logger = logging.getLogger(__name__)
+
+conversation_db_path = os.getenv(
+    "CONVERSATION_DB_PATH", os.path.join(os.path.dirname(__file__), "db", "conversations.db")
+)
+
+ROLES = ("user", "ai")
+
+
+class ConversationStore:
+    """회원/날짜별 대화를 SQLite(WAL) 에 append-only 로 저장하는 저장소.
+
+    쓰기는 단일 writer 스레드에서 순서대로 처리되므로 같은 회원의 턴 순서가
+    보장되고, append() 는 기다리지 않아도 되는(write-behind) future 를 돌려준다.
+    recent() 는 해당 회원의 대기 중인 쓰기가 끝난 뒤 마지막 N 개만 읽는다.
+    최근 N 개보다 오래된 턴은 conversation_summary 의 누적 요약으로 대신한다.
+    """
+
+    def __init__(self, db_path=conversation_db_path, read_workers=4):
+        self.db_path = db_path
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="conversation-reader")
+        self._pending = {}
+        self._create_tables()
+
+    def _connection(self):
+        return get_connection(self.db_path)
+
+    def _create_tables(self):
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS conversation (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                member_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_conversation_member_day
+            ON conversation (member_id, day, id)
+        ''')
+        # last_id: 요약에 반영된 마지막 conversation.id
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_summary (
+                member_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                last_id INTEGER NOT NULL,
+                PRIMARY KEY (member_id, day)
+            )
+        ''')
+        conn.commit()
+
+    def _insert(self, member_id, day, entries):
+        conn = self._connection()
+        with span("context_save"), conn:
+            conn.executemany(
+                "INSERT INTO conversation (member_id, day, role, content) VALUES (?, ?, ?, ?)",
+                [(member_id, day, role, content) for role, content in entries],
+            )
+
+    def _select_recent(self, member_id, day, limit):
+        rows = self._connection().execute('''
+            SELECT content FROM conversation
+            WHERE member_id = ? AND day = ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (member_id, day, limit)).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def _select_summary(self, member_id, day):
+        row = self._connection().execute(
+            "SELECT summary, last_id FROM conversation_summary WHERE member_id = ? AND day = ?",
+            (member_id, day),
+        ).fetchone()
+        return row if row is not None else ("", 0)
+
+    def _select_unsummarized(self, member_id, day, keep):
+        """요약에 아직 반영되지 않았고 최근 keep 개에도 들지 않는 턴을 (id, role, content) 로."""
+        _, last_id = self._select_summary(member_id, day)
+        rows = self._connection().execute('''
+            SELECT id, role, content FROM conversation
+            WHERE member_id = ? AND day = ? AND id > ?
+            ORDER BY id
+        ''', (member_id, day, last_id)).fetchall()
+        return rows[:max(0, len(rows) - keep)]
+
+    def _upsert_summary(self, member_id, day, summary, last_id):
+        conn = self._connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO conversation_summary (member_id, day, summary, last_id) VALUES (?, ?, ?, ?)
+                ON CONFLICT (member_id, day) DO UPDATE SET summary = excluded.summary, last_id = excluded.last_id
+                WHERE excluded.last_id > conversation_summary.last_id
+            ''', (member_id, day, summary, last_id))
+
+    def append(self, member_id, day, entries):
+        """[(role, content), ...] 를 한 트랜잭션으로 추가한다. 결과를 기다릴 필요는 없다."""
+        member_id = str(member_id)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._writer, self._insert, member_id, day, list(entries))
+        self._pending[member_id] = future
+
+        def _done(done_future):
+            if self._pending.get(member_id) is done_future:
+                del self._pending[member_id]
+            if not done_future.cancelled() and done_future.exception() is not None:
+                logger.error("Failed to save conversation for %s: %s", member_id, done_future.exception())
+
+        future.add_done_callback(_done)
+        return future
+
+    async def recent(self, member_id, day, limit):
+        member_id = str(member_id)
+        pending = self._pending.get(member_id)
+        if pending is not None:
+            await asyncio.wait([pending])
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._select_recent, member_id, day, limit)
+
+    async def summary(self, member_id, day):
+        loop = asyncio.get_running_loop()
+        summary, _ = await loop.run_in_executor(self._readers, self._select_summary, str(member_id), day)
+        return summary
+
+    async def unsummarized(self, member_id, day, keep):
+        member_id = str(member_id)
+        pending = self._pending.get(member_id)
+        if pending is not None:
+            await asyncio.wait([pending])
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._select_unsummarized, member_id, day, keep)
+
+    async def save_summary(self, member_id, day, summary, last_id):
+        # 턴 저장과 같은 writer 스레드에서 순서대로 쓴다.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self._upsert_summary, str(member_id), day, summary, last_id)
+
+    async def flush(self):
+        if self._pending:
+            await asyncio.wait(list(self._pending.values()))
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        # writer/reader 스레드가 연 연결까지 닫는다.
+        close_connections(self.db_path)
+
+
+def migrate_contexts(store, context_dir):
+    """contexts/{member_id}_{YYYYMMDD}.json 파일들을 대화 저장소로 옮긴다.
+
+    이미 같은 회원/날짜의 대화가 있으면 건너뛰므로 여러 번 실행해도 된다.
+    """
+    imported = 0
+    for filename in sorted(os.listdir(context_dir)):
+        match = re.fullmatch(r"(.+)_(\d{8})\.json", filename)
+        if not match:
+            continue
+        member_id, day = match.groups()
+        if store._select_recent(member_id, day, 1):
+            print(f"Skipped {filename}: already imported")
+            continue
+        with open(os.path.join(context_dir, filename), "r") as file:
+            context = json.load(file).get("context", [])
+        # 컨텍스트는 "이전 마지막 5개 + 새 질문 + 답변" 이라 보통 홀수 개이고 답변으로 시작한다.
+        # 마지막 항목이 항상 답변이므로 끝에서부터 역할을 정한다.
+        store._insert(
+            member_id, day, [(ROLES[(i - len(context)) % 2], content) for i, content in enumerate(context)]
+        )
+        imported += 1
+        print(f"Imported {filename}: {len(context)} entries")
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conversation store utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="import the legacy contexts/ directory")
+    migrate_parser.add_argument(
+        "context_dir", nargs="?", default=os.path.join(os.path.dirname(__file__), "contexts")
+    )
+    migrate_parser.add_argument("--db", default=conversation_db_path)
+    args = parser.parse_args()
+
+    conversation_store = ConversationStore(args.db)
+    count = migrate_contexts(conversation_store, args.context_dir)
+    print(f"Imported {count} context files into {args.db}")
+    conversation_store.close()
@@ -1,12 +1,53 @@
-from sentence_transformers import SentenceTransformer, util
-import sqlite3
+import argparse
+import asyncio
+import logging
+import os
+import threading
 from datetime import datetime
+import numpy as np
+from metrics import db_seconds, timed
+from model_registry import model_registry
+from sqlite_pool import get_connection
 
-db_path = 'db/chat_history.db'
-model = SentenceTransformer('all-MiniLM-L6-v2')
+logger = logging.getLogger(__name__)
 
+db_path = os.path.join(os.path.dirname(__file__), 'db', 'chat_history.db')
+# 메시지 임베딩은 정규화된 float16 벡터로 chat_history.embedding 에 저장
+EMBEDDING_DTYPE = np.float16
+
+# 모델은 처음 임베딩할 때 로드되고, SHARE_EMBEDDING_MODEL=1 이면 문서 검색용 모델을 같이 쓴다.
+def _embeddings():
+    return model_registry.get_embeddings('chat_history')
+
+def encode_contents(contents):
+    embeddings = np.asarray(_embeddings().embed_documents(contents), dtype=np.float32)
+    return [embedding.astype(EMBEDDING_DTYPE).tobytes() for embedding in embeddings]
+
+def _ensure_embedding_column(cursor):
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(chat_history)')]
+    # 테이블이 아직 없으면 create_db() 가 embedding 컬럼까지 만든다.
+    if columns and 'embedding' not in columns:
+        cursor.execute('ALTER TABLE chat_history ADD COLUMN embedding BLOB')
+
+_schema_lock = threading.Lock()
+_schema_checked = False
+
+def _connection():
+    # 스레드마다 하나의 연결을 재사용 (WAL, busy_timeout 등은 sqlite_pool 에서 설정)
+    global _schema_checked
+    conn = get_connection(db_path)
+    if not _schema_checked:
+        # 예전 스키마의 DB 파일도 바로 쓸 수 있도록 처음 쓸 때 한 번 embedding 컬럼을 추가한다.
+        with _schema_lock:
+            if not _schema_checked:
+                _ensure_embedding_column(conn.cursor())
+                conn.commit()
+                _schema_checked = True
+    return conn
+
+@timed(db_seconds)
 def create_db():
-    conn = sqlite3.connect(db_path)
+    conn = _connection()
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS chat_history (
@@ -14,80 +55,159 @@ def create_db():
             member_id TEXT NOT NULL,
             created_at TEXT NOT NULL,
             role TEXT NOT NULL,
-            content TEXT NOT NULL
+            content TEXT NOT NULL,
+            embedding BLOB
         )
     ''')
+    _ensure_embedding_column(cursor)
+    # 회원별/날짜별 조회가 전체 테이블을 훑지 않도록
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_history_member_created
+        ON chat_history (member_id, created_at)
+    ''')
     conn.commit()
-    conn.close()
-    print('Database created')
+    logger.info('Database created')
 
-def insert_chat_history(member_id, role, content):
-    if content == '':
-        content = 'No content'
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+@timed(db_seconds)
+def insert_chat_turn(member_id, messages):
+    """[(role, content), ...] 를 한 트랜잭션으로 저장한다 (예: user/ai 한 턴)."""
+    messages = [(role, content if content != '' else 'No content') for role, content in messages]
+
+    # 저장할 때 한 번만 임베딩한다.
+    embeddings = encode_contents([content for _, content in messages])
+
+    conn = _connection()
     created_at = datetime.now().strftime('%Y%m%d')
-    cursor.execute('''
-        INSERT INTO chat_history (member_id, created_at, role, content)
-        VALUES (?, ?, ?, ?)
-    ''', (member_id, created_at, role, content))
-    conn.commit()
-    conn.close()
-    print(f'Chat history inserted: {member_id}, {role}, {content}')
+    with conn:
+        conn.executemany('''
+            INSERT INTO chat_history (member_id, created_at, role, content, embedding)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (member_id, created_at, role, content, embedding)
+            for (role, content), embedding in zip(messages, embeddings)
+        ])
+    for role, content in messages:
+        logger.debug('Chat history inserted: %s, %s, %s', member_id, role, content)
 
+def insert_chat_history(member_id, role, content):
+    insert_chat_turn(member_id, [(role, content)])
+
+@timed(db_seconds)
 def get_chat_history(member_id):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = _connection().cursor()
     cursor.execute('''
         SELECT member_id, created_at, role, content
         FROM chat_history
         WHERE member_id = ?
-        ORDER BY created_at
+        ORDER BY created_at, id
     ''', (member_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    return cursor.fetchall()
 
+@timed(db_seconds)
 def get_today_chat_history(member_id):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = _connection().cursor()
     created_at = datetime.now().strftime('%Y%m%d')
     cursor.execute('''
         SELECT member_id, created_at, role, content
         FROM chat_history
         WHERE member_id = ? AND created_at = ?
-        ORDER BY created_at
+        ORDER BY id
     ''', (member_id, created_at))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    return cursor.fetchall()
 
-def get_related_chat_history(member_id, sentence, k=5):
-    conn = sqlite3.connect(db_path)
+@timed(db_seconds)
+def get_related_chat_history(member_id, sentence, k=5, since=None):
+    conn = _connection()
     cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT content
+
+    # since(YYYYMMDD) 가 주어지면 그 날짜 이후의 메시지만 비교
+    query = '''
+        SELECT id, content, embedding
         FROM chat_history
         WHERE member_id = ?
-    ''', (member_id,))
+    '''
+    query_params = [member_id]
+    if since is not None:
+        query += ' AND created_at >= ?'
+        query_params.append(since)
+    cursor.execute(query, query_params)
     rows = cursor.fetchall()
-    conn.close()
-    
-    chat_history = [row[0] for row in rows]
-    
-    sentence_embedding = model.encode(sentence, convert_to_tensor=True)
-    chat_history_embeddings = model.encode(chat_history, convert_to_tensor=True)
-    
-    cos_scores = util.pytorch_cos_sim(sentence_embedding, chat_history_embeddings)[0]
-    
-    top_k_indices = cos_scores.topk(min(k, len(rows))).indices
-    
+
+    if not rows:
+        return []
+
+    sentence_embedding = np.asarray(_embeddings().embed_query(sentence), dtype=np.float32)
+    dimension = sentence_embedding.shape[0]
+    itemsize = np.dtype(EMBEDDING_DTYPE).itemsize
+
+    # 아직 임베딩이 없는 (또는 차원이 다른) 행은 이번에 임베딩해서 저장해 둔다.
+    missing = [i for i, row in enumerate(rows) if row[2] is None or len(row[2]) != dimension * itemsize]
+    if missing:
+        blobs = encode_contents([rows[i][1] for i in missing])
+        cursor.executemany(
+            'UPDATE chat_history SET embedding = ? WHERE id = ?',
+            [(blob, rows[i][0]) for i, blob in zip(missing, blobs)],
+        )
+        conn.commit()
+        for i, blob in zip(missing, blobs):
+            rows[i] = (rows[i][0], rows[i][1], blob)
+
+    chat_history = [row[1] for row in rows]
+    chat_history_embeddings = np.frombuffer(b''.join(row[2] for row in rows), dtype=EMBEDDING_DTYPE)
+    chat_history_embeddings = chat_history_embeddings.reshape(len(rows), dimension)
+
+    cos_scores = chat_history_embeddings.astype(np.float32) @ sentence_embedding.astype(np.float32)
+
+    k = min(k, len(rows))
+    top_k_indices = np.argpartition(-cos_scores, k - 1)[:k]
+    top_k_indices = top_k_indices[np.argsort(-cos_scores[top_k_indices])]
+
     related_chat_history = [chat_history[idx] for idx in top_k_indices]
-    
+
     return related_chat_history
-    
+
+def backfill_embeddings(batch_size=256):
+    """embedding 이 비어 있는 기존 행을 배치로 임베딩한다."""
+    conn = _connection()
+    cursor = conn.cursor()
+    _ensure_embedding_column(cursor)
+    total = 0
+    while True:
+        cursor.execute('''
+            SELECT id, content
+            FROM chat_history
+            WHERE embedding IS NULL
+            LIMIT ?
+        ''', (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        blobs = encode_contents([row[1] for row in rows])
+        cursor.executemany(
+            'UPDATE chat_history SET embedding = ? WHERE id = ?',
+            [(blob, row[0]) for row, blob in zip(rows, blobs)],
+        )
+        conn.commit()
+        total += len(rows)
+        print(f'Backfilled {total} embeddings')
+    return total
+
+# FastAPI 핸들러에서 이벤트 루프를 막지 않도록 스레드에서 실행하는 async 버전
+async def ainsert_chat_turn(member_id, messages):
+    return await asyncio.to_thread(insert_chat_turn, member_id, messages)
+
+async def ainsert_chat_history(member_id, role, content):
+    return await asyncio.to_thread(insert_chat_history, member_id, role, content)
+
+async def aget_chat_history(member_id):
+    return await asyncio.to_thread(get_chat_history, member_id)
+
+async def aget_today_chat_history(member_id):
+    return await asyncio.to_thread(get_today_chat_history, member_id)
+
+async def aget_related_chat_history(member_id, sentence, k=5, since=None):
+    return await asyncio.to_thread(get_related_chat_history, member_id, sentence, k, since)
+
 # Test
 # create_db()
 
@@ -96,4 +216,14 @@ def get_related_chat_history(member_id, sentence, k=5):
 
 # history = get_chat_history('user123')
 # for record in history:
-#     print(record)
\ No newline at end of file
+#     print(record)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='chat_history.db utilities')
+    parser.add_argument('command', choices=['create', 'backfill'])
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        create_db()
+    elif args.command == 'backfill':
+        backfill_embeddings()
@@ -0,0 +1,127 @@
+import os
+from collections import deque
+
+keywords_path = os.path.join(os.path.dirname(__file__), "keywords")
+
+# 점수가 같을 때 우선순위 (기존 if/elif 순서)
+DOMAIN_PRIORITY = ["kdrama", "freedom", "krecipe", "capitalism", "christianity", "democracy"]
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 오토마톤: 모든 키워드를 질문 한 번의 스캔으로 찾는다."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.keywords = []
+        self.keyword_ids = {}
+
+    def add(self, keyword):
+        if keyword in self.keyword_ids:
+            return self.keyword_ids[keyword]
+        node = 0
+        for char in keyword:
+            if char not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[node][char] = len(self.goto) - 1
+            node = self.goto[node][char]
+        keyword_id = len(self.keywords)
+        self.keywords.append(keyword)
+        self.keyword_ids[keyword] = keyword_id
+        self.output[node].append(keyword_id)
+        return keyword_id
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """(시작 위치, 끝 위치, 키워드 id) 를 모두 돌려준다."""
+        matches = []
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for keyword_id in self.output[node]:
+                end = position + 1
+                matches.append((end - len(self.keywords[keyword_id]), end, keyword_id))
+        return matches
+
+
+class DomainClassifier:
+    def __init__(self, domain_keywords):
+        self.automaton = KeywordAutomaton()
+        self.keyword_domains = {}
+        for domain, keywords in domain_keywords.items():
+            for keyword in keywords:
+                keyword_id = self.automaton.add(keyword)
+                self.keyword_domains.setdefault(keyword_id, set()).add(domain)
+        self.automaton.build()
+        self.domains = list(domain_keywords)
+
+    @classmethod
+    def from_directory(cls, directory=keywords_path):
+        """keywords/{domain}.txt 파일(한 줄에 키워드 하나, # 은 주석)에서 불러온다."""
+        domain_keywords = {}
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(".txt"):
+                continue
+            with open(os.path.join(directory, filename), "r", encoding="utf-8") as file:
+                keywords = [line.strip() for line in file]
+            domain_keywords[filename[:-4]] = [k for k in keywords if k and not k.startswith("#")]
+        return cls(domain_keywords)
+
+    def _priority(self, domain):
+        return DOMAIN_PRIORITY.index(domain) if domain in DOMAIN_PRIORITY else len(DOMAIN_PRIORITY)
+
+    def score(self, question):
+        """도메인별 점수를 [(domain, score), ...] 로 높은 순서대로 돌려준다.
+
+        더 긴 키워드 안에 포함된 짧은 매치는 버리고, 남은 키워드는 길이만큼
+        점수를 주되 여러 도메인에 걸친 키워드는 그 도메인 수로 나눈다.
+        """
+        matches = self.automaton.find(question)
+        matched = set()
+        for start, end, keyword_id in matches:
+            if any(s <= start and end <= e and (s, e) != (start, end) for s, e, _ in matches):
+                continue
+            matched.add(keyword_id)
+
+        scores = {}
+        for keyword_id in matched:
+            domains = self.keyword_domains[keyword_id]
+            weight = len(self.automaton.keywords[keyword_id]) / len(domains)
+            for domain in domains:
+                scores[domain] = scores.get(domain, 0) + weight
+        return sorted(scores.items(), key=lambda item: (-item[1], self._priority(item[0])))
+
+    def classify(self, question, min_ratio=0.5):
+        """최고 점수의 min_ratio 이상인 도메인을 모두 돌려준다. 매치가 없으면 []."""
+        scores = self.score(question)
+        if not scores:
+            return []
+        top_score = scores[0][1]
+        return [domain for domain, score in scores if score >= top_score * min_ratio]
+
+
+domain_classifier = DomainClassifier.from_directory()
+
+
+def classify_domains(question: str) -> list:
+    return domain_classifier.classify(question) or ["general"]
+
+
+def classify_domain(question: str) -> str:
+    return classify_domains(question)[0]
@@ -0,0 +1,497 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import numpy as np
+from domain_classifier import KeywordAutomaton
+from ingest import document_entities, document_extra_text, domain_sources, load_documents, load_entity_aliases
+from lexical_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+index_path = os.getenv("INDEX_DIR", os.path.join(os.path.dirname(__file__), "index"))
+
+# 인덱스 형식이나 청킹 설정이 바뀌면 전체를 다시 임베딩한다.
+INDEX_VERSION = 6
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "300"))
+
+# 검색 기본값: 전체 도메인에서 상위 k 개, 유사도 임계값 미만은 버림
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.3"))
+
+# 하이브리드 검색: 임베딩/BM25 순위를 Reciprocal Rank Fusion 으로 합친다.
+RRF_K = 60
+# 임베딩 후보에 없는 청크는 BM25 점수가 상한(max_score)의 이 비율 이상일 때만 합친다.
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", "0.3"))
+HYBRID_CANDIDATES = 4  # 각 순위에서 k * HYBRID_CANDIDATES 개씩 후보를 가져옴
+ENTITY_MIN_CHARS = 3  # 이보다 짧은 이름은 정확 매치에 쓰지 않음
+HANGUL_ENTITY_MIN_CHARS = 2  # 한글 이름은 두 글자(현빈, 미생)부터
+
+# 한 번에 점수를 계산하는 행 수 (mmap 에서 float32 로 읽어오는 메모리 상한)
+SCORE_BLOCK_ROWS = 8192
+
+# 청크가 IVF_MIN_ROWS 개 이상인 도메인은 근사(IVF) 인덱스를 만든다.
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", "20000"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_TRAIN_SAMPLE = 20000
+IVF_ITERATIONS = 10
+
+
+def _file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _save_array(path, array):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        np.save(file, array)
+    os.replace(tmp_path, path)
+
+
+def _save_meta(path, meta):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(meta, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _split_long(sentence, max_chars):
+    """max_chars 보다 긴 문장을 공백 위치(없으면 글자 수)에서 잘라 나눈다."""
+    pieces = []
+    while len(sentence) > max_chars:
+        cut = sentence.rfind(" ", 0, max_chars + 1)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(sentence[:cut].strip())
+        sentence = sentence[cut:].strip()
+    if sentence:
+        pieces.append(sentence)
+    return pieces
+
+
+def chunk_text(text, max_chars=CHUNK_MAX_CHARS):
+    """문장 단위로 max_chars 이하의 청크로 나눈다. 이웃 청크는 문장 하나씩 겹친다."""
+    if len(text) <= max_chars:
+        return [text]
+    sentences = [
+        piece
+        for s in re.split(r"(?<=[.!?。])\s+|\n+", text) if s.strip()
+        for piece in _split_long(s, max_chars)
+    ]
+    chunks = []
+    current = []
+    for sentence in sentences:
+        if current and len(" ".join(current + [sentence])) > max_chars:
+            chunks.append(" ".join(current))
+            current = current[-1:] if len(current[-1]) + len(sentence) < max_chars else []
+        current.append(sentence)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def field_chunk(document):
+    """구조화된 필드(출연, 감독, 장르 등)를 한 청크로 묶는다."""
+    return "\n".join(f"{label}: {value}" for label, value in document.get("fields", {}).items())
+
+
+def chunk_documents(documents):
+    """[(문서 번호, 청크 텍스트), ...] 를 돌려준다. 필드가 있는 문서는 필드 청크가 먼저 온다.
+
+    본문 뒤에는 나머지 키(레시피 단계 등)의 청크가 온다.
+    """
+    chunks = []
+    for doc_idx, document in enumerate(documents):
+        if document.get("fields"):
+            chunks.append((doc_idx, field_chunk(document)))
+        if document.get("text"):
+            chunks.extend((doc_idx, chunk) for chunk in chunk_text(document["text"]))
+        extra_text = document_extra_text(document)
+        if extra_text:
+            chunks.extend((doc_idx, chunk) for chunk in chunk_text(extra_text))
+    return chunks
+
+
+def _entity_key(name):
+    return " ".join(name.lower().split())
+
+
+def _is_entity_key(key):
+    if "가" <= key[:1] <= "힣":
+        return len(key) >= HANGUL_ENTITY_MIN_CHARS
+    return len(key) >= ENTITY_MIN_CHARS
+
+
+def _is_word_boundary(text, start, end):
+    # 이름 앞에 글자가 붙어 있거나(새로운 → 로운) 뒤가 영문/숫자로 이어지면 다른 단어의 일부이므로 제외
+    # (뒤에 붙는 한글 조사는 허용)
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    return not before.isalnum() and not (after.isascii() and after.isalnum())
+
+
+def _kmeans(vectors, nlist, iterations=IVF_ITERATIONS, seed=0):
+    """정규화된 벡터에 대한 구면 k-means (내적 기준)."""
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), min(len(vectors), IVF_TRAIN_SAMPLE), replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(nlist):
+            members = sample[assignment == i]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[i] = centroid / (np.linalg.norm(centroid) or 1.0)
+    return centroids
+
+
+class DomainIndex:
+    """한 도메인 폴더의 문서 청크 임베딩을 디스크에 보관하는 인덱스.
+
+    vectors.npy 는 (청크 수, 차원) 의 정규화된 float32 행렬이며 mmap 으로 읽고,
+    meta.json 에는 파일별 mtime/sha256/문서·청크 범위, 문서 원본, 청크가 들어간다.
+    청크 수가 IVF_MIN_ROWS 이상이면 ivf_*.npy 에 근사 검색용 목록을 함께 저장한다.
+    BM25 역색인과 이름(entities) 오토마톤은 불러올 때 메모리에서 만든다.
+    """
+
+    def __init__(self, domain, domain_path, index_dir):
+        self.domain = domain
+        self.domain_path = domain_path
+        self.index_dir = os.path.join(index_dir, domain)
+        self.vectors_path = os.path.join(self.index_dir, "vectors.npy")
+        self.meta_path = os.path.join(self.index_dir, "meta.json")
+        self.ivf_centroids_path = os.path.join(self.index_dir, "ivf_centroids.npy")
+        self.ivf_rows_path = os.path.join(self.index_dir, "ivf_rows.npy")
+        self.ivf_offsets_path = os.path.join(self.index_dir, "ivf_offsets.npy")
+        self._reset()
+
+    def _reset(self):
+        self.files = {}
+        self.documents = []
+        self.chunks = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.ivf = None
+        self.lexical = BM25Index([])
+        self.entities = None
+        self.entity_docs = {}
+        self.doc_rows = {}
+
+    def load(self):
+        if not (os.path.exists(self.meta_path) and os.path.exists(self.vectors_path)):
+            return False
+        with open(self.meta_path, "r") as file:
+            meta = json.load(file)
+        if meta.get("version") != INDEX_VERSION or meta.get("chunk_max_chars") != CHUNK_MAX_CHARS:
+            self._reset()
+            return False
+        self.files = meta["files"]
+        self.documents = meta["documents"]
+        self.chunks = meta["chunks"]
+        self.vectors = np.load(self.vectors_path, mmap_mode="r")
+        self.ivf = None
+        if os.path.exists(self.ivf_centroids_path):
+            self.ivf = (
+                np.load(self.ivf_centroids_path),
+                np.load(self.ivf_rows_path, mmap_mode="r"),
+                np.load(self.ivf_offsets_path),
+            )
+        self._build_lexical()
+        return True
+
+    def _build_lexical(self):
+        self.lexical = BM25Index([
+            f"{self.documents[doc_idx].get('title', '')}\n{chunk}" for doc_idx, chunk in self.chunks
+        ])
+        self.entities = KeywordAutomaton()
+        self.entity_docs = {}
+        aliases = load_entity_aliases(self.domain)
+        for doc_idx, document in enumerate(self.documents):
+            for name in document_entities(document):
+                key = _entity_key(name)
+                for entity_key in [key] + [_entity_key(alias) for alias in aliases.get(key, [])]:
+                    if _is_entity_key(entity_key):
+                        self.entity_docs.setdefault(self.entities.add(entity_key), []).append(doc_idx)
+        self.entities.build()
+        # load() 와 build() 가 연달아 불러도 행이 중복되지 않도록 새로 만든다.
+        self.doc_rows = {}
+        for row, (doc_idx, _) in enumerate(self.chunks):
+            self.doc_rows.setdefault(doc_idx, []).append(row)
+
+    def _is_unchanged(self, filename, file_path, stat):
+        previous = self.files.get(filename)
+        if previous is None:
+            return False, None
+        if previous["mtime"] == stat.st_mtime and previous["size"] == stat.st_size:
+            return True, previous["sha256"]
+        sha256 = _file_sha256(file_path)
+        return previous["sha256"] == sha256, sha256
+
+    def build(self, embed_texts):
+        """변경된 파일만 다시 청킹/임베딩하고, 나머지는 기존 벡터를 재사용한다."""
+        if not os.path.exists(self.domain_path):
+            raise ValueError(f"Domain path {self.domain_path} does not exist")
+
+        self.load()
+        files = {}
+        documents = []
+        chunks = []
+        blocks = []
+        changed = False
+
+        sources = domain_sources(self.domain, self.domain_path)
+        if {filename for filename, _ in sources} != set(self.files):
+            changed = True
+
+        for filename, file_path in sources:
+            stat = os.stat(file_path)
+            unchanged, sha256 = self._is_unchanged(filename, file_path, stat)
+            doc_start, row_start = len(documents), len(chunks)
+
+            if unchanged:
+                previous = self.files[filename]
+                file_documents = self.documents[previous["doc_start"]:previous["doc_end"]]
+                offset = doc_start - previous["doc_start"]
+                file_chunks = [
+                    [doc_idx + offset, chunk]
+                    for doc_idx, chunk in self.chunks[previous["row_start"]:previous["row_end"]]
+                ]
+                file_vectors = np.asarray(self.vectors[previous["row_start"]:previous["row_end"]])
+            else:
+                try:
+                    file_documents = load_documents(file_path)
+                except (json.JSONDecodeError, ValueError) as error:
+                    logger.warning("Failed to load %s: %s", filename, error)
+                    continue  # 문제가 있는 파일은 건너뛰고 다음 파일로 진행
+                sha256 = sha256 or _file_sha256(file_path)
+                file_chunks = [[doc_start + doc_idx, chunk] for doc_idx, chunk in chunk_documents(file_documents)]
+                texts = [
+                    f"{file_documents[doc_idx - doc_start].get('title', '')}\n{chunk}"
+                    for doc_idx, chunk in file_chunks
+                ]
+                file_vectors = np.asarray(embed_texts(texts), dtype=np.float32) if texts else None
+                changed = True
+                logger.info(
+                    "Embedded %d chunks of %d documents from %s/%s",
+                    len(file_chunks), len(file_documents), self.domain, filename,
+                )
+
+            if not file_chunks:
+                continue
+            documents.extend(file_documents)
+            chunks.extend(file_chunks)
+            blocks.append(file_vectors)
+            files[filename] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "sha256": sha256,
+                "doc_start": doc_start,
+                "doc_end": len(documents),
+                "row_start": row_start,
+                "row_end": len(chunks),
+            }
+
+        if not changed and files == self.files:
+            return
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        vectors = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+        # mmap 으로 열려 있는 기존 파일을 교체하기 전에 참조를 끊는다.
+        self._reset()
+        _save_array(self.vectors_path, vectors)
+        self._build_ivf(vectors)
+        _save_meta(self.meta_path, {
+            "version": INDEX_VERSION,
+            "chunk_max_chars": CHUNK_MAX_CHARS,
+            "files": files,
+            "documents": documents,
+            "chunks": chunks,
+        })
+        self.load()
+
+    def _build_ivf(self, vectors):
+        paths = (self.ivf_centroids_path, self.ivf_rows_path, self.ivf_offsets_path)
+        if len(vectors) < IVF_MIN_ROWS:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+
+        nlist = int(np.sqrt(len(vectors)))
+        centroids = _kmeans(vectors, nlist)
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+            block = vectors[start:start + SCORE_BLOCK_ROWS]
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        # 목록별로 행 번호를 모아 두고, offsets[i]:offsets[i+1] 이 i 번째 목록
+        rows = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[rows], np.arange(nlist + 1))
+        for path, array in zip(paths, (centroids, rows, offsets)):
+            _save_array(path, array)
+        logger.info("Built IVF index for %s: %d lists over %d chunks", self.domain, nlist, len(vectors))
+
+    def _candidate_rows(self, query, nprobe):
+        centroids, rows, offsets = self.ivf
+        nprobe = min(nprobe, len(centroids))
+        probes = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([rows[offsets[i]:offsets[i + 1]] for i in probes]))
+
+    def search(self, query_embedding, k=RETRIEVAL_TOP_K, threshold=RETRIEVAL_MIN_SCORE, nprobe=IVF_NPROBE):
+        """유사도가 threshold 이상인 상위 k 개 청크를 (점수, 행 번호) 로 돌려준다."""
+        if len(self.chunks) == 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+
+        if self.ivf is not None:
+            candidate_rows = self._candidate_rows(query, nprobe)
+            scores = np.asarray(self.vectors[candidate_rows]) @ query
+        else:
+            candidate_rows = None
+            # 벡터는 정규화되어 있으므로 내적이 곧 코사인 유사도 (블록 단위로 계산해 메모리 제한)
+            scores = np.concatenate([
+                np.asarray(self.vectors[start:start + SCORE_BLOCK_ROWS]) @ query
+                for start in range(0, len(self.chunks), SCORE_BLOCK_ROWS)
+            ])
+        if len(scores) == 0:
+            return []
+
+        count = min(k, len(scores))
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidate_rows is None else candidate_rows[top]
+        return [(float(scores[i]), int(row)) for i, row in zip(top, rows) if scores[i] >= threshold]
+
+    def result(self, row):
+        """행 번호를 (문서 id, 청크 텍스트를 담은 문서) 로 바꾼다."""
+        doc_idx, chunk = self.chunks[row]
+        document = self.documents[doc_idx]
+        for filename, entry in self.files.items():
+            if entry["doc_start"] <= doc_idx < entry["doc_end"]:
+                doc_id = f"{self.domain}/{filename}#{document.get('id', doc_idx - entry['doc_start'])}"
+                break
+        document = {key: value for key, value in document.items() if key not in ("fields", "entities")}
+        return doc_id, {**document, "text": chunk}
+
+    def lexical_search(self, query, k=RETRIEVAL_TOP_K, rows=None):
+        return self.lexical.search(query, k, rows)
+
+    def match_entities(self, query):
+        """질문에 정확히 들어 있는 작품명/인물 이름의 문서 번호들을 돌려준다."""
+        if self.entities is None:
+            return set()
+        text = _entity_key(query)
+        doc_indices = set()
+        for start, end, entity_id in self.entities.find(text):
+            if _is_word_boundary(text, start, end):
+                doc_indices.update(self.entity_docs[entity_id])
+        return doc_indices
+
+
+class EmbeddingIndex:
+    def __init__(self, documents_dir, index_dir=index_path):
+        self.documents_dir = documents_dir
+        self.index_dir = index_dir
+        self.domains = {}
+
+    def build(self, embed_texts):
+        """시작 시 모든 도메인 인덱스를 불러오고, 바뀐 파일만 다시 임베딩한다."""
+        for domain in sorted(os.listdir(self.documents_dir)):
+            if os.path.isdir(os.path.join(self.documents_dir, domain)):
+                self.domain(domain).build(embed_texts)
+
+    def open(self):
+        """다른 프로세스(serve.py)가 만든 인덱스를 임베딩 없이 불러온다.
+
+        벡터는 읽기 전용 mmap 이므로 여러 워커가 같은 페이지 캐시를 공유한다.
+        인덱스가 없거나 형식이 다르면 ValueError.
+        """
+        for domain in sorted(os.listdir(self.documents_dir)):
+            if not os.path.isdir(os.path.join(self.documents_dir, domain)):
+                continue
+            domain_index = DomainIndex(domain, os.path.join(self.documents_dir, domain), self.index_dir)
+            if not domain_index.load():
+                raise ValueError(f"Index for {domain} is missing in {self.index_dir}")
+            self.domains[domain] = domain_index
+
+    def domain(self, domain):
+        if domain not in self.domains:
+            domain_index = DomainIndex(
+                domain, os.path.join(self.documents_dir, domain), self.index_dir
+            )
+            domain_index.load()
+            self.domains[domain] = domain_index
+        return self.domains[domain]
+
+    def _top_documents(self, candidates, k):
+        """(점수, 도메인 인덱스, 행 번호) 후보에서 문서별로 가장 높은 청크만 골라 상위 k 개."""
+        candidates.sort(key=lambda candidate: -candidate[0])
+        results = []
+        seen = set()
+        for score, domain_index, row in candidates:
+            doc_id, document = domain_index.result(row)
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            results.append((doc_id, document, score))
+            if len(results) == k:
+                break
+        return results
+
+    def search(self, domains, query, query_embedding, k=RETRIEVAL_TOP_K, threshold=RETRIEVAL_MIN_SCORE):
+        """여러 도메인에 걸친 하이브리드(임베딩 + BM25) top-k 를 (문서 id, 문서, 점수) 로 돌려준다.
+
+        임베딩 순위와 BM25 순위를 도메인 전체에서 각각 매긴 뒤 RRF 점수
+        sum(1 / (RRF_K + 순위)) 로 합친다. 임베딩 유사도가 threshold 미만인 문서의
+        BM25 후보는 정규화 점수가 LEXICAL_MIN_SCORE 이상일 때만 남긴다.
+        같은 문서의 청크가 여러 개 걸리면 가장 점수가 높은 청크만 남긴다.
+        문서 id 는 "{domain}/{파일명}#{문서의 id}" 형식이다.
+        """
+        dense, lexical = [], []
+        for domain in domains:
+            domain_index = self.domain(domain)
+            # 문서 중복을 걸러낸 뒤에도 k 개가 남도록 넉넉히 가져온다.
+            dense_docs = set()
+            for score, row in domain_index.search(query_embedding, k * HYBRID_CANDIDATES, threshold):
+                dense.append((score, domain, row))
+                dense_docs.add(domain_index.chunks[row][0])
+            max_score = domain_index.lexical.max_score(query)
+            for score, row in domain_index.lexical_search(query, k * HYBRID_CANDIDATES):
+                if domain_index.chunks[row][0] in dense_docs or score >= LEXICAL_MIN_SCORE * max_score:
+                    lexical.append((score, domain, row))
+
+        fused = {}
+        for ranking in (dense, lexical):
+            ranking.sort(key=lambda candidate: -candidate[0])
+            for rank, (_, domain, row) in enumerate(ranking):
+                fused[(domain, row)] = fused.get((domain, row), 0.0) + 1 / (RRF_K + rank + 1)
+        return self._top_documents(
+            [(score, self.domains[domain], row) for (domain, row), score in fused.items()], k
+        )
+
+    def lookup(self, domains, query, k=RETRIEVAL_TOP_K):
+        """작품명/인물 이름이 정확히 들어 있는 질문은 임베딩 없이 BM25 로만 찾는다.
+
+        이름이 맞은 문서의 청크 안에서 BM25 순위를 매기고, 매치가 없으면 [] 를 돌려준다.
+        """
+        candidates = []
+        for domain in domains:
+            domain_index = self.domain(domain)
+            doc_indices = domain_index.match_entities(query)
+            if not doc_indices:
+                continue
+            rows = [row for doc_idx in sorted(doc_indices) for row in domain_index.doc_rows.get(doc_idx, [])]
+            ranked = domain_index.lexical_search(query, k * HYBRID_CANDIDATES, rows)
+            if not ranked:
+                # 이름 말고는 겹치는 단어가 없으면 문서의 첫 청크(필드 청크)를 쓴다.
+                ranked = [(0.0, domain_index.doc_rows[doc_idx][0]) for doc_idx in sorted(doc_indices)]
+            candidates.extend((score, domain_index, row) for score, row in ranked)
+        return self._top_documents(candidates, k)
+
+    def match_domains(self, query):
+        """질문에 작품명/인물 이름이 들어 있는 도메인 목록."""
+        return [domain for domain, domain_index in self.domains.items() if domain_index.match_entities(query)]
@@ -0,0 +1,152 @@
+"""여러 uvicorn 워커가 함께 쓰는 임베딩 서버 (유닉스 소켓).
+
+모델은 이 프로세스에만 올라가고, 워커는 RemoteEmbeddings 로 요청을 보낸다.
+프레임: 4바이트 길이(big-endian) + JSON. 요청은 {"model", "kind", "texts"},
+응답은 {"shape": [n, d]} 뒤에 n*d 개의 little-endian float32, 실패하면 {"error"}.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import numpy as np
+from embedding_service import EmbeddingService
+from model_registry import EMBEDDING_MODELS, model_registry
+
+logger = logging.getLogger(__name__)
+
+socket_path = os.getenv("EMBEDDING_SERVER_SOCKET", "/tmp/nk-bot-embeddings.sock")
+
+_header = struct.Struct(">I")
+
+
+def _encode_frame(payload):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return _header.pack(len(data)) + data
+
+
+class EmbeddingServer:
+    """모델별 EmbeddingService 로 요청을 처리한다.
+
+    kind="query" 는 워커들의 질의를 한 번의 forward pass 로 묶고 LRU 캐시를
+    공유하며, kind="documents" 는 인덱스 빌드처럼 큰 배치를 그대로 인코딩한다.
+    """
+
+    def __init__(self, path=socket_path, registry=model_registry):
+        self.path = path
+        self.registry = registry
+        self.services = {}
+
+    def _service(self, model_name):
+        if model_name not in EMBEDDING_MODELS.values():
+            raise ValueError(f"Unknown embedding model {model_name}")
+        if model_name not in self.services:
+            self.services[model_name] = EmbeddingService(self.registry.lazy_model(model_name))
+        return self.services[model_name]
+
+    async def _embed(self, request):
+        service = self._service(request["model"])
+        texts = request["texts"]
+        if request["kind"] == "query":
+            return await asyncio.gather(*(service.embed_query(text) for text in texts))
+        return await service.embed_documents(texts)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    (length,) = _header.unpack(await reader.readexactly(_header.size))
+                    request = json.loads(await reader.readexactly(length))
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    vectors = np.asarray(await self._embed(request), dtype="<f4")
+                    writer.write(_encode_frame({"shape": list(vectors.shape)}) + vectors.tobytes())
+                except Exception as e:
+                    logger.exception("Embedding request failed")
+                    writer.write(_encode_frame({"error": str(e)}))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        logger.info("Embedding server listening on %s", self.path)
+        async with server:
+            await server.serve_forever()
+
+
+class RemoteEmbeddings:
+    """embed_documents/embed_query 를 임베딩 서버로 보내는 클라이언트 (스레드마다 연결 하나)."""
+
+    def __init__(self, model_name, path=socket_path, timeout=120.0):
+        self.model_name = model_name
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _read_exactly(self, sock, size):
+        chunks = []
+        while size:
+            chunk = sock.recv(min(size, 1 << 20))
+            if not chunk:
+                raise ConnectionError("Embedding server closed the connection")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def _request(self, kind, texts):
+        frame = _encode_frame({"model": self.model_name, "kind": kind, "texts": texts})
+        # 서버가 재시작되어 끊긴 연결이면 한 번 다시 연결한다.
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(frame)
+                (length,) = _header.unpack(self._read_exactly(sock, _header.size))
+                response = json.loads(self._read_exactly(sock, length))
+                if "error" in response:
+                    raise RuntimeError(f"Embedding server error: {response['error']}")
+                rows, dimension = response["shape"]
+                payload = self._read_exactly(sock, rows * dimension * 4)
+                return np.frombuffer(payload, dtype="<f4").reshape(rows, dimension)
+            except (ConnectionError, BrokenPipeError, socket.timeout):
+                self._close()
+                if attempt:
+                    raise
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self._request("documents", list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self._request("query", [text])[0].tolist()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared embedding server for multi-worker mode")
+    parser.add_argument("--socket", default=socket_path)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    asyncio.run(EmbeddingServer(args.socket).serve())
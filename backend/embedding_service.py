@@ -0,0 +1,105 @@
+import asyncio
+import re
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def normalize_text(text):
+    # 캐시 키: 유니코드 정규화 + 공백 정리
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class EmbeddingService:
+    """임베딩 모델 호출을 이벤트 루프 밖(스레드 풀)에서 실행하는 서비스.
+
+    동시에 들어온 질의들은 max_wait_ms 동안 모아 한 번의 forward pass 로
+    인코딩하고, 질의 임베딩은 정규화된 텍스트를 키로 LRU 캐시에 보관한다.
+    """
+
+    def __init__(self, embeddings, max_batch_size=32, max_wait_ms=5, cache_size=2048, max_workers=1):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embedding")
+        self._cache = OrderedDict()
+        self._pending = []
+        self._inflight = {}
+        self._flush_handle = None
+        # 실행 중인 배치 태스크 (참조를 잡아 두지 않으면 끝나기 전에 GC 될 수 있다)
+        self._batch_tasks = set()
+
+    def _cache_get(self, key):
+        vector = self._cache.get(key)
+        if vector is not None:
+            self._cache.move_to_end(key)
+        return vector
+
+    def _cache_put(self, key, vector):
+        self._cache[key] = vector
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def embed_query(self, text):
+        key = normalize_text(text)
+        vector = self._cache_get(key)
+        if vector is not None:
+            return vector
+
+        # 같은 질의가 이미 인코딩 중이면 그 결과를 같이 기다린다.
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._inflight[key] = future
+            self._pending.append((key, future))
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        # 한 요청이 취소되어도 공유된 future 는 취소되지 않도록 shield
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch):
+        texts = [key for key, _ in batch]
+        try:
+            vectors = await self.embed_documents(texts)
+        except Exception as e:
+            for key, future in batch:
+                self._inflight.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (key, future), vector in zip(batch, vectors):
+            self._cache_put(key, vector)
+            self._inflight.pop(key, None)
+            if not future.done():
+                future.set_result(vector)
+
+    async def embed_documents(self, texts):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.embeddings.embed_documents, texts)
+
+    def stats(self):
+        return {
+            "cache_size": len(self._cache),
+            "cache_max_size": self.cache_size,
+            "pending": len(self._pending),
+            "inflight": len(self._inflight),
+            "batches_running": len(self._batch_tasks),
+        }
@@ -0,0 +1,176 @@
+"""검색 코퍼스로 들어가는 원본(JSON/CSV)을 문서 목록으로 읽어온다.
+
+문서는 {"id", "title", "text"} 에 선택적으로 "fields"(라벨 → 값, 필드 청크로
+임베딩됨)와 "entities"(작품명/배우 이름처럼 정확히 찾을 이름) 를 갖는다.
+이름에는 ENTITY_ALIASES 의 별칭(영문 작품명/배우 이름의 한글 표기)도 함께 쓴다.
+그 밖의 키(레시피의 "recipe" 단계 목록 등)는 document_extra_text() 로 본문에 이어 붙여
+청크로 임베딩하고 프롬프트에도 넣는다.
+"""
+import csv
+import json
+import os
+
+backend_path = os.path.dirname(__file__)
+documents_path = os.path.join(backend_path, "documents")
+
+SOURCE_EXTENSIONS = (".json", ".csv")
+
+# documents/{domain}/ 밖에 있는 추가 원본
+EXTRA_SOURCES = {
+    "kdrama": [os.path.join(backend_path, "db", "kdrama.csv")],
+}
+
+# 이름 → 별칭 CSV (name,alias 한 줄에 하나). kdrama.csv 의 이름은 영문이라
+# 한글 질문("사랑의 불시착 줄거리", "현빈 나오는 드라마")도 이름으로 찾도록 한글 표기를 붙인다.
+ENTITY_ALIASES = {
+    "kdrama": [os.path.join(backend_path, "db", "kdrama_aliases.csv")],
+}
+
+# 문서 구조에 쓰이는 키. 나머지 키는 추가 본문으로 다룬다.
+DOCUMENT_KEYS = ("id", "title", "text", "fields", "entities")
+
+# JSON 문서 제목이 "작품명 - 소제목" 형식이면 작품명을 이름으로 쓴다.
+TITLE_ENTITY_SEPARATOR = " - "
+
+# CSV 헤더 → 문서 변환 규칙. title/text 는 열 이름, fields 는 (열 이름, 라벨),
+# entities 는 쉼표로 구분된 이름 목록이 들어 있는 열.
+CSV_SCHEMAS = [
+    {
+        "columns": {"Name", "Synopsis", "Cast"},
+        "title": "Name",
+        "text": "Synopsis",
+        "fields": [
+            ("Year of release", "방영 연도"),
+            ("Aired Date", "방영일"),
+            ("Original Network", "방송사"),
+            ("Number of Episodes", "회차"),
+            ("Genre", "장르"),
+            ("Tags", "태그"),
+            ("Director", "감독"),
+            ("Screenwriter", "각본"),
+            ("Cast", "출연"),
+            ("Rating", "평점"),
+        ],
+        "entities": ["Name", "Cast", "Director"],
+    },
+]
+
+# 스키마가 없는 CSV 는 아래 이름의 열을 제목/본문으로 쓰고 나머지 열은 필드로 둔다.
+DEFAULT_TITLE_COLUMNS = ("title", "name", "제목", "이름")
+DEFAULT_TEXT_COLUMNS = ("text", "synopsis", "description", "content", "본문", "내용", "줄거리")
+
+
+def _split_names(value):
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def _clean(value):
+    return " ".join((value or "").split())
+
+
+def _csv_schema(columns):
+    for schema in CSV_SCHEMAS:
+        if schema["columns"] <= set(columns):
+            return schema
+
+    def find(candidates):
+        for column in columns:
+            if column.strip().lower() in candidates:
+                return column
+        return None
+
+    title, text = find(DEFAULT_TITLE_COLUMNS), find(DEFAULT_TEXT_COLUMNS)
+    if text is None:
+        raise ValueError(f"CSV has no text column: {columns}")
+    return {
+        "title": title,
+        "text": text,
+        "fields": [(column, column) for column in columns if column not in (title, text)],
+        "entities": [title] if title else [],
+    }
+
+
+def iter_csv_documents(file_path):
+    """CSV 를 한 행씩 읽어 문서로 바꾼다 (파일 전체를 메모리에 올리지 않음)."""
+    with open(file_path, "r", encoding="utf-8-sig", newline="") as file:
+        reader = csv.DictReader(file)
+        schema = _csv_schema(reader.fieldnames or [])
+        for row_number, row in enumerate(reader):
+            fields = {}
+            for column, label in schema["fields"]:
+                value = _clean(row.get(column))
+                if value:
+                    fields[label] = value
+            entities = []
+            for column in schema["entities"]:
+                if column == schema["title"]:
+                    # 작품명에는 쉼표가 들어갈 수 있다 (Kill Me, Heal Me).
+                    entities.append(_clean(row.get(column)))
+                else:
+                    entities.extend(_split_names(row.get(column) or ""))
+            yield {
+                "id": row_number + 1,
+                "title": _clean(row.get(schema["title"])) if schema["title"] else "",
+                "text": _clean(row.get(schema["text"])),
+                "fields": fields,
+                "entities": entities,
+            }
+
+
+def load_documents(file_path):
+    if file_path.endswith(".csv"):
+        return list(iter_csv_documents(file_path))
+    with open(file_path, "r") as file:
+        return json.load(file)
+
+
+def domain_sources(domain, domain_path):
+    """도메인의 원본 파일을 [(이름, 경로), ...] 로 돌려준다."""
+    sources = [
+        (filename, os.path.join(domain_path, filename))
+        for filename in sorted(os.listdir(domain_path))
+        if filename.endswith(SOURCE_EXTENSIONS)
+    ]
+    for file_path in EXTRA_SOURCES.get(domain, []):
+        if os.path.exists(file_path):
+            sources.append((os.path.basename(file_path), file_path))
+    return sources
+
+
+def document_entities(document):
+    """문서의 이름 목록. 없으면 "작품명 - 소제목" 형식 제목의 작품명."""
+    if document.get("entities"):
+        return document["entities"]
+    title = document.get("title", "")
+    if TITLE_ENTITY_SEPARATOR in title:
+        return [title.split(TITLE_ENTITY_SEPARATOR, 1)[0].strip()]
+    return []
+
+
+def load_entity_aliases(domain):
+    """{이름: [별칭, ...]} (이름은 비교용으로 소문자·공백 정리)."""
+    aliases = {}
+    for file_path in ENTITY_ALIASES.get(domain, []):
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, "r", encoding="utf-8-sig", newline="") as file:
+            for row in csv.DictReader(file):
+                name, alias = _clean(row.get("name")).lower(), _clean(row.get("alias"))
+                if name and alias:
+                    aliases.setdefault(name, []).append(alias)
+    return aliases
+
+
+def document_extra_text(document):
+    """title/text 외의 키를 줄 단위 텍스트로 만든다 (목록은 한 줄에 한 항목)."""
+    lines = []
+    for key, value in document.items():
+        if key in DOCUMENT_KEYS or value in (None, "", [], {}):
+            continue
+        if isinstance(value, list):
+            lines.extend(str(item) for item in value)
+        elif isinstance(value, dict):
+            lines.extend(f"{label}: {item}" for label, item in value.items())
+        else:
+            lines.append(f"{key}: {value}")
+    return "\n".join(lines)
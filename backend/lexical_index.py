@@ -0,0 +1,109 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+import numpy as np
+
+# 한국어 조사/어미 (긴 것부터 떼어낸다)
+KOREAN_SUFFIXES = sorted([
+    "은", "는", "이", "가", "을", "를", "의", "에", "에서", "에게", "한테", "께서",
+    "으로", "로", "와", "과", "도", "만", "까지", "부터", "이랑", "랑", "하고",
+    "이나", "나", "보다", "처럼", "이야", "야", "이에요", "예요", "입니다", "이다",
+    "인가요", "인가", "이란", "란", "이라는", "라는",
+], key=len, reverse=True)
+
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[가-힣]+")
+
+
+def _strip_suffix(token):
+    for suffix in KOREAN_SUFFIXES:
+        if len(token) > len(suffix) and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    """BM25 용 토큰: 영문/숫자 단어, 조사를 뗀 한글 어절, 한글 음절 bigram.
+
+    형태소 분석기 없이도 복합명사(자본주의경제 → 자본/본주/주의/...)와
+    조사가 붙은 어절(드라마에서 → 드라마)이 서로 맞도록 bigram 을 함께 쓴다.
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text):
+        if "가" <= token[0] <= "힣":
+            stem = _strip_suffix(token)
+            tokens.append(stem)
+            if len(stem) > 2:
+                tokens.extend(stem[i:i + 2] for i in range(len(stem) - 1))
+        else:
+            tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """청크 텍스트 목록에 대한 메모리 내 BM25 역색인.
+
+    postings[토큰] = (행 번호 배열, 토큰 빈도 배열) 이고, 질의 토큰의 posting 만
+    더하므로 질의 길이에 비례하는 비용으로 점수를 계산한다.
+    """
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(texts)
+        lengths = np.zeros(self.size, dtype=np.float32)
+        postings = {}
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[row] = sum(counts.values())
+            for token, count in counts.items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(row)
+                postings[token][1].append(count)
+        average_length = float(lengths.mean()) if self.size else 0.0
+        # 문서 길이 정규화 항은 질의와 무관하므로 미리 계산해 둔다.
+        self._length_norm = k1 * (1 - b + b * lengths / (average_length or 1.0))
+        self.postings = {
+            token: (np.asarray(rows, dtype=np.int64), np.asarray(counts, dtype=np.float32))
+            for token, (rows, counts) in postings.items()
+        }
+
+    def _idf(self, document_frequency):
+        return math.log(1 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def scores(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            rows, counts = posting
+            idf = self._idf(len(rows))
+            scores[rows] += idf * counts * (self.k1 + 1) / (counts + self._length_norm[rows])
+        return scores
+
+    def max_score(self, query):
+        """질의가 얻을 수 있는 BM25 점수의 상한 (모든 질의 토큰이 아주 많이 나올 때)."""
+        return sum(
+            self._idf(len(self.postings[token][0])) * (self.k1 + 1)
+            for token in set(tokenize(query)) if token in self.postings
+        )
+
+    def search(self, query, k, rows=None):
+        """BM25 점수가 0 보다 큰 상위 k 개를 (점수, 행 번호) 로 돌려준다. rows 가 있으면 그 안에서만."""
+        if self.size == 0:
+            return []
+        scores = self.scores(query)
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            candidate_scores = scores[rows]
+        else:
+            rows = np.arange(self.size)
+            candidate_scores = scores
+        count = min(k, len(rows))
+        if count == 0:
+            return []
+        top = np.argpartition(-candidate_scores, count - 1)[:count]
+        top = top[np.argsort(-candidate_scores[top])]
+        return [(float(candidate_scores[i]), int(rows[i])) for i in top if candidate_scores[i] > 0]
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from metrics import stage_seconds
+
+
+class SchedulerOverloaded(Exception):
+    """대기열이 가득 찼거나 마감 시간 안에 처리할 수 없을 때 발생 (HTTP 429)."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"LLM is overloaded: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LLMScheduler:
+    """LLM 호출 앞단의 동시 실행 제한 + 회원별 공정 대기열.
+
+    동시에 max_concurrency 개까지만 생성하고, 나머지는 회원별 큐에 넣어
+    라운드 로빈으로 슬롯을 넘긴다. 예상 대기 시간이 마감(max_wait)을 넘거나
+    큐가 가득 차면 바로 SchedulerOverloaded 로 거절한다.
+    """
+
+    def __init__(self, max_concurrency=2, max_queue=32, max_wait=60.0, initial_service_time=10.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._service_time = initial_service_time
+        self._in_flight = 0
+        self._queue_depth = 0
+        self._queues = OrderedDict()
+        self._admitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @classmethod
+    def from_env(cls, prefix="LLM", max_concurrency=2):
+        # 모델마다 따로 설정: LLM_MAX_CONCURRENCY, SMALL_LLM_MAX_CONCURRENCY, ...
+        return cls(
+            max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", str(max_concurrency))),
+            max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", "32")),
+            max_wait=float(os.getenv(f"{prefix}_MAX_WAIT_SECONDS", "60")),
+        )
+
+    def estimate_wait(self):
+        """지금 줄을 서면 슬롯을 얻기까지 걸릴 예상 시간(초)."""
+        if self._in_flight < self.max_concurrency and self._queue_depth == 0:
+            return 0.0
+        return (self._queue_depth + 1) / self.max_concurrency * self._service_time
+
+    def estimate_latency(self):
+        """지금 요청하면 생성이 끝날 때까지의 예상 시간(초): 대기 + 평균 서비스 시간."""
+        return self.estimate_wait() + self._service_time
+
+    def is_saturated(self):
+        """지금 줄을 서면 거절될 상태인지."""
+        if self._in_flight < self.max_concurrency and self._queue_depth == 0:
+            return False
+        return self._queue_depth >= self.max_queue or self.estimate_wait() > self.max_wait
+
+    def _reject(self, reason, retry_after):
+        self._rejected += 1
+        raise SchedulerOverloaded(reason, max(1.0, retry_after))
+
+    def _dequeue(self, member_id, waiter):
+        queue = self._queues.get(member_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._queue_depth -= 1
+            if not queue:
+                del self._queues[member_id]
+
+    def _release(self):
+        # 다음 회원에게 슬롯을 넘기고, 그 회원은 큐의 맨 뒤로 보낸다.
+        while self._queues:
+            member_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self._queue_depth -= 1
+            if queue:
+                self._queues.move_to_end(member_id)
+            else:
+                del self._queues[member_id]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, member_id, timeout=None):
+        deadline = self.max_wait if timeout is None else timeout
+        enqueued_at = time.monotonic()
+
+        if self._in_flight < self.max_concurrency and self._queue_depth == 0:
+            self._in_flight += 1
+        else:
+            if self._queue_depth >= self.max_queue:
+                self._reject("queue is full", self.estimate_wait())
+            estimated_wait = self.estimate_wait()
+            if estimated_wait > deadline:
+                self._reject("estimated wait exceeds deadline", estimated_wait)
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(member_id, deque()).append(waiter)
+            self._queue_depth += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), deadline)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done() and not waiter.cancelled():
+                    # 타임아웃 직전에 슬롯을 넘겨받았으면 돌려준다.
+                    self._release()
+                else:
+                    waiter.cancel()
+                    self._dequeue(member_id, waiter)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._reject("deadline exceeded while queued", self.estimate_wait())
+
+        waited = time.monotonic() - enqueued_at
+        self._admitted += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        stage_seconds.observe("llm_queue_wait", waited)
+
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            # 서비스 시간은 지수 이동 평균으로 추정 (대기 시간 예측용)
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started_at)
+            self._completed += 1
+            self._release()
+
+    def stats(self):
+        return {
+            "in_flight": self._in_flight,
+            "queue_depth": self._queue_depth,
+            "queued_members": len(self._queues),
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+            "completed": self._completed,
+            "wait_seconds_total": self._wait_total,
+            "wait_seconds_max": self._wait_max,
+            "service_seconds_avg": self._service_time,
+        }
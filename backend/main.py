@@ -1,13 +1,40 @@
 # main.py
-from typing import Union
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import logging
+import math
+import os
+from contextlib import asynccontextmanager
+from typing import List, Union
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from langchain_core.output_parsers import JsonOutputParser
-from agent import ChatAgent
+from agent import ChatAgent, embedding_service
+from llm_scheduler import SchedulerOverloaded
+from metrics import registry
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 
-app = FastAPI()
 chat_agent = ChatAgent()
+
+@asynccontextmanager
+async def lifespan(app):
+    # 모델 로딩/인덱스 빌드는 백그라운드에서 진행하고, 끝나면 /readyz 가 200 을 돌려준다.
+    warmup_task = asyncio.create_task(chat_agent.warmup())
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        await chat_agent.aclose()
+
+app = FastAPI(lifespan=lifespan)
+registry.gauge("nkbot_llm_scheduler", "LLM scheduler state.", chat_agent.scheduler.stats)
+registry.gauge("nkbot_model_router", "Per-model scheduler state and routing decisions.", chat_agent.router.stats)
+registry.gauge("nkbot_session_cache", "WebSocket session cache state.", chat_agent.sessions.stats)
+registry.gauge("nkbot_response_cache", "Response cache state.", chat_agent.response_cache.stats)
+registry.gauge("nkbot_embedding_service", "Query embedding cache and batching state.", embedding_service.stats)
 origins = ["*"]
 # origins = ["http://localhost:3000", "http://23.21.39.159"],  # 프론트엔드 주소
 
@@ -26,17 +53,143 @@ class ChatRequestParams(BaseModel):
     member_id: int
     question: str
 
+# 일괄 질문 한 번에 받을 수 있는 질문 수 / LLM 동시 호출 수 상한
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+class BatchRequestParams(BaseModel):
+    questions: List[str]
+    member_id: Union[int, None] = None
+    concurrency: int = 2
+    persist: bool = False
+
+def _too_many_requests(e: SchedulerOverloaded):
+    return HTTPException(
+        status_code=429,
+        detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))},
+    )
+
 @app.post("/chat", response_model=ChatResponseParams)
 async def chat(params: ChatRequestParams):
     try:
         # Invoke the chain with the updated params
         response = await chat_agent.get_response(params)
 
-        print(f"response: {response.content}")
         return {"answer_from_ai": response.content}
+    except SchedulerOverloaded as e:
+        raise _too_many_requests(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(params: ChatRequestParams):
+    # Server-Sent Events: 토큰이 생성되는 대로 {"token": ...} 을 보내고, 끝나면 done 이벤트
+    stream = chat_agent.stream_response(params)
+    # 첫 토큰까지 미리 받아서, 대기열에서 거절되면 스트림 대신 429 를 돌려준다.
+    try:
+        first_token = await stream.__anext__()
+    except StopAsyncIteration:
+        first_token = None
+    except SchedulerOverloaded as e:
+        raise _too_many_requests(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def events():
+        try:
+            if first_token is not None:
+                yield _sse_event({"token": first_token})
+                async for token in stream:
+                    yield _sse_event({"token": token})
+            yield _sse_event({}, event="done")
+        except Exception as e:
+            yield _sse_event({"detail": str(e)}, event="error")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/ws/chat")
+async def chat_ws(websocket: WebSocket):
+    # 연결 하나로 여러 질문을 주고받는다. {"member_id", "question"} 을 받으면
+    # {"token": ...} 들을 보내고 {"event": "done"} (실패하면 {"event": "error", ...}) 으로 끝낸다.
+    # 회원의 최근 대화/검색 결과는 세션 캐시에 두고 메시지마다 다시 읽지 않는다.
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                params = ChatRequestParams(**await websocket.receive_json())
+            except (ValueError, TypeError) as e:
+                await websocket.send_json({"event": "error", "status": 422, "detail": str(e)})
+                continue
+
+            try:
+                session = await chat_agent.session(params.member_id)
+                async for token in chat_agent.stream_response(params, session):
+                    await websocket.send_json({"token": token})
+                await websocket.send_json({"event": "done"})
+            except SchedulerOverloaded as e:
+                await websocket.send_json({
+                    "event": "error", "status": 429, "detail": str(e), "retry_after": math.ceil(e.retry_after),
+                })
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_json({"event": "error", "status": 500, "detail": str(e)})
+    except WebSocketDisconnect:
+        pass
+
+@app.post("/chat/batch")
+async def chat_batch(params: BatchRequestParams):
+    # NDJSON: 답변이 끝나는 순서대로 한 줄에 하나씩 {"index", "question", "answer", ...}
+    if len(params.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    if params.persist and params.member_id is None:
+        raise HTTPException(status_code=422, detail="member_id is required when persist is true")
+    concurrency = max(1, min(params.concurrency, BATCH_MAX_CONCURRENCY))
+
+    async def lines():
+        async for result in chat_agent.batch_responses(
+            params.questions, params.member_id, concurrency, params.persist
+        ):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/stats")
+async def stats():
+    return {
+        "llm_scheduler": chat_agent.scheduler.stats(),
+        "model_router": chat_agent.router.stats(),
+        "session_cache": chat_agent.sessions.stats(),
+        "response_cache": chat_agent.response_cache.stats(),
+        "embedding_service": embedding_service.stats(),
+    }
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    status_code = 200 if chat_agent.ready else 503
+    return JSONResponse(
+        {"status": "ready" if chat_agent.ready else "warming_up", **chat_agent.readiness},
+        status_code=status_code,
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8501)
\ No newline at end of file
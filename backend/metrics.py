@@ -0,0 +1,114 @@
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+# 초 단위 지연 시간 버킷 (임베딩 수 ms ~ CPU 에서의 LLM 생성 수십 초)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    """레이블 하나(stage, function 등)를 갖는 Prometheus 히스토그램."""
+
+    def __init__(self, name, help_text, label_name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(
+                        f'{self.name}_bucket{{{self.label_name}="{label}",le="{_format_value(bound)}"}} {count}'
+                    )
+                lines.append(f'{self.name}_sum{{{self.label_name}="{label}"}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{self.label_name}="{label}"}} {series["count"]}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}
+
+    def histogram(self, name, help_text, label_name, buckets=DEFAULT_BUCKETS):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, help_text, label_name, buckets)
+        return self.histograms[name]
+
+    def gauge(self, prefix, help_text, callback):
+        """callback() 이 돌려주는 dict 의 숫자 값을 {prefix}_{key} 게이지로 내보낸다."""
+        self.gauges[prefix] = (help_text, callback)
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms.values():
+            lines.extend(histogram.render())
+        for prefix, (help_text, callback) in self.gauges.items():
+            for key, value in callback().items():
+                if isinstance(value, (int, float)):
+                    name = f"{prefix}_{key}"
+                    lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+stage_seconds = registry.histogram(
+    "nkbot_stage_seconds", "Latency of each get_response stage in seconds.", "stage"
+)
+db_seconds = registry.histogram(
+    "nkbot_db_seconds", "Latency of db_handler functions in seconds.", "function"
+)
+
+
+@contextmanager
+def span(label, histogram=stage_seconds):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(label, time.perf_counter() - started_at)
+
+
+def timed(histogram, label=None):
+    """함수 실행 시간을 histogram 에 기록하는 데코레이터 (동기/비동기 모두 지원)."""
+
+    def decorator(func):
+        name = label or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, histogram):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, histogram):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,90 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 용도별 임베딩 모델. SHARE_EMBEDDING_MODEL=1 이면 대화 기록 검색도
+# 문서 검색용 모델(bge-m3)을 같이 써서 메모리에 모델을 하나만 올린다.
+EMBEDDING_MODELS = {
+    "retrieval": os.getenv("RETRIEVAL_EMBEDDING_MODEL", "BAAI/bge-m3"),  # "jhgan/ko-sroberta-multitask"
+    "chat_history": os.getenv("CHAT_HISTORY_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+}
+SHARE_EMBEDDING_MODEL = os.getenv("SHARE_EMBEDDING_MODEL", "0") == "1"
+
+# - NVidia GPU: "cuda"
+# - Mac M1, M2, M3: "mps"
+# - CPU: "cpu"
+model_kwargs = {
+    "device": os.getenv("EMBEDDING_DEVICE", "cpu")
+}
+
+encode_kwargs = {"normalize_embeddings": True}
+
+
+def _load_embeddings(model_name):
+    if os.getenv("EMBEDDING_SERVER_SOCKET"):
+        # 멀티 워커 모드: 모델은 임베딩 서버 프로세스에만 올리고 소켓으로 요청한다.
+        from embedding_server import RemoteEmbeddings
+        return RemoteEmbeddings(model_name, os.environ["EMBEDDING_SERVER_SOCKET"])
+
+    if os.getenv("EMBEDDING_BACKEND", "huggingface") == "fake":
+        # 벤치마크용: 모델 없이 결정적인 벡터를 만드는 가벼운 임베딩
+        from bench.fake_embedder import FakeEmbeddings
+        return FakeEmbeddings()
+
+    # from langchain_huggingface import HuggingFaceEmbeddings
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs=encode_kwargs,
+    )
+
+
+class ModelRegistry:
+    """임베딩 모델을 처음 쓸 때 한 번만 로드하고, 같은 모델은 용도끼리 공유한다."""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model_name(self, role):
+        if SHARE_EMBEDDING_MODEL:
+            return EMBEDDING_MODELS["retrieval"]
+        return EMBEDDING_MODELS[role]
+
+    def get_model(self, model_name):
+        embeddings = self._models.get(model_name)
+        if embeddings is None:
+            with self._lock:
+                embeddings = self._models.get(model_name)
+                if embeddings is None:
+                    logger.info("Loading embedding model %s", model_name)
+                    embeddings = self._models[model_name] = _load_embeddings(model_name)
+        return embeddings
+
+    def get_embeddings(self, role):
+        return self.get_model(self.model_name(role))
+
+    def lazy(self, role):
+        return LazyEmbeddings(lambda: self.get_embeddings(role))
+
+    def lazy_model(self, model_name):
+        return LazyEmbeddings(lambda: self.get_model(model_name))
+
+
+class LazyEmbeddings:
+    """embed_documents/embed_query 를 처음 호출할 때 레지스트리에서 모델을 가져온다."""
+
+    def __init__(self, load):
+        self.load = load
+
+    def embed_documents(self, texts):
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.load().embed_query(text)
+
+
+model_registry = ModelRegistry()
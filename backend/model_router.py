@@ -0,0 +1,101 @@
+import logging
+import os
+from collections import Counter
+from contextlib import asynccontextmanager
+from langchain_ollama import ChatOllama
+from llm_scheduler import LLMScheduler
+from metrics import registry, span
+
+logger = logging.getLogger(__name__)
+
+llm_seconds = registry.histogram(
+    "nkbot_llm_seconds", "LLM generation latency per model in seconds.", "model"
+)
+
+
+class ModelRoute:
+    """Ollama 모델 하나와 그 모델 전용 스케줄러(동시 실행 수, 대기열)."""
+
+    def __init__(self, name, llm, scheduler):
+        self.name = name
+        self.llm = llm
+        self.scheduler = scheduler
+
+    @property
+    def model(self):
+        return self.llm.model
+
+    @asynccontextmanager
+    async def slot(self, member_id):
+        async with self.scheduler.slot(member_id):
+            with span(self.model, llm_seconds):
+                yield
+
+
+class ModelRouter:
+    """요청마다 큰 모델과 작은 모델 중 하나를 고른다.
+
+    - general 도메인(잡담)이고 프롬프트가 small_max_prompt_tokens 이하면 작은 모델
+      (작은 모델이 거절될 상태면 큰 모델)
+    - 큰 모델이 거절될 상태이거나 예상 지연이 fallback_latency 를 넘고
+      작은 모델이 더 빠를 것으로 보이면 작은 모델 (과부하 시 대체)
+    - 나머지는 큰 모델
+    """
+
+    def __init__(self, large, small=None, small_max_prompt_tokens=1024, fallback_latency=20.0):
+        self.large = large
+        self.small = small
+        self.small_max_prompt_tokens = small_max_prompt_tokens
+        self.fallback_latency = fallback_latency
+        self._decisions = Counter()
+
+    @classmethod
+    def from_env(cls, large_llm, large_scheduler=None):
+        large = ModelRoute("large", large_llm, large_scheduler or LLMScheduler.from_env())
+        small = None
+        # SMALL_LLM_MODEL 을 지정했을 때만 라우팅한다 (예: llama3.2:3B). 없으면 큰 모델만 쓴다.
+        small_model = os.getenv("SMALL_LLM_MODEL", "")
+        if small_model:
+            small_llm = ChatOllama(model=small_model, keep_alive=large_llm.keep_alive)
+            small = ModelRoute("small", small_llm, LLMScheduler.from_env("SMALL_LLM", max_concurrency=4))
+        return cls(
+            large,
+            small,
+            small_max_prompt_tokens=int(os.getenv("ROUTER_SMALL_MAX_PROMPT_TOKENS", "1024")),
+            fallback_latency=float(os.getenv("ROUTER_FALLBACK_LATENCY_SECONDS", "20")),
+        )
+
+    @property
+    def routes(self):
+        return [route for route in (self.large, self.small) if route is not None]
+
+    def _choose(self, domains, prompt_tokens):
+        if self.small is None:
+            return self.large, "default"
+        if (
+            domains == ["general"]
+            and prompt_tokens <= self.small_max_prompt_tokens
+            and not self.small.scheduler.is_saturated()
+        ):
+            return self.small, "general"
+        if self.large.scheduler.is_saturated() or self.large.scheduler.estimate_latency() > self.fallback_latency:
+            if not self.small.scheduler.is_saturated() and (
+                self.small.scheduler.estimate_latency() < self.large.scheduler.estimate_latency()
+            ):
+                return self.small, "overloaded"
+        return self.large, "domain"
+
+    def route(self, domains, prompt_tokens):
+        route, reason = self._choose(domains, prompt_tokens)
+        self._decisions[(route.name, reason)] += 1
+        logger.debug("Routed to %s (%s): domains=%s prompt_tokens=%d", route.model, reason, domains, prompt_tokens)
+        return route
+
+    def stats(self):
+        stats = {}
+        for route in self.routes:
+            for key, value in route.scheduler.stats().items():
+                stats[f"{route.name}_{key}"] = value
+        for (name, reason), count in sorted(self._decisions.items()):
+            stats[f"routed_{name}_{reason}"] = count
+        return stats
@@ -0,0 +1,159 @@
+import logging
+import os
+import re
+from functools import lru_cache
+from ingest import document_extra_text
+
+logger = logging.getLogger(__name__)
+
+# 어림 토큰 수: 한글 음절·기호·이모지는 1 토큰, 영문/숫자 단어는 4 글자당 1 토큰.
+# EEVE 토크나이저는 한글을 이보다 적은 토큰으로 나누므로 예산을 넘지 않는 쪽으로 어림한다.
+TOKEN_PIECE_PATTERN = re.compile(r"[A-Za-z0-9]+|\S")
+
+# 정확하게 세고 싶으면 PROMPT_TOKENIZER 에 Hugging Face 토크나이저 이름을 지정한다.
+# (예: yanolja/EEVE-Korean-Instruct-10.8B-v1.0)
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER")
+
+TRUNCATION_MARK = "…"
+
+
+@lru_cache(maxsize=1)
+def _tokenizer():
+    if not PROMPT_TOKENIZER:
+        return None
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(PROMPT_TOKENIZER)
+    except Exception:
+        logger.exception("Failed to load tokenizer %s, falling back to estimates", PROMPT_TOKENIZER)
+        return None
+
+
+def count_tokens(text):
+    tokenizer = _tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return sum(
+        (len(piece) + 3) // 4 if piece[0].isascii() and piece[0].isalnum() else 1
+        for piece in TOKEN_PIECE_PATTERN.findall(text)
+    )
+
+
+def truncate_to_tokens(text, budget):
+    """앞에서부터 budget 토큰까지만 남긴다. 잘렸으면 끝에 … 를 붙인다."""
+    if count_tokens(text) <= budget:
+        return text
+    if budget <= 0:
+        return ""
+    # 글자 수에 대해 이분 탐색 (토큰 수는 글자 수에 대해 단조 증가)
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) + 1 <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + TRUNCATION_MARK
+
+
+class PromptBudget:
+    """request_prompt 의 섹션별 토큰 예산."""
+
+    def __init__(self, documents=1200, summary=300, recent=600, recent_turn=200, question=300):
+        self.documents = documents
+        self.summary = summary
+        self.recent = recent
+        self.recent_turn = recent_turn
+        self.question = question
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            documents=int(os.getenv("PROMPT_BUDGET_DOCUMENTS", "1200")),
+            summary=int(os.getenv("PROMPT_BUDGET_SUMMARY", "300")),
+            recent=int(os.getenv("PROMPT_BUDGET_RECENT", "600")),
+            recent_turn=int(os.getenv("PROMPT_BUDGET_RECENT_TURN", "200")),
+            question=int(os.getenv("PROMPT_BUDGET_QUESTION", "300")),
+        )
+
+
+def _document_body(document):
+    """검색된 청크 + 나머지 키(레시피 단계 등). 청크가 이미 그 내용이면 한 번만 넣는다."""
+    text = document.get("text", "")
+    extra_text = document_extra_text(document)
+    if not extra_text or " ".join(text.split()) in " ".join(extra_text.split()):
+        return text
+    return f"{text}\n{extra_text}" if text else extra_text
+
+
+def render_documents(documents, budget):
+    """검색 순위대로 문서를 넣고, 예산을 넘는 문서는 잘라낸 뒤 나머지는 버린다."""
+    lines = []
+    remaining = budget
+    for document in documents:
+        title = document.get("title", "")
+        body = _document_body(document)
+        line = f"- {title}: {body}" if title else f"- {body}"
+        tokens = count_tokens(line)
+        if tokens > remaining:
+            line = truncate_to_tokens(line, remaining)
+            if line:
+                lines.append(line)
+            break
+        lines.append(line)
+        remaining -= tokens
+    return "\n".join(lines)
+
+
+def render_recent(context, budget, turn_budget):
+    """최근 대화를 최신 것부터 예산 안에서 채운다. 긴 답변은 turn_budget 으로 자른다."""
+    lines = []
+    remaining = budget
+    for content in reversed(context):
+        line = truncate_to_tokens(content, turn_budget)
+        tokens = count_tokens(line)
+        if tokens > remaining:
+            break
+        lines.append(line)
+        remaining -= tokens
+    return "\n".join(reversed(lines))
+
+
+def build_request_prompt(question, documents, context, summary="", budget=None):
+    """섹션별 예산을 지킨 human 메시지를 만든다. 토큰 수도 함께 돌려준다.
+
+    요청마다 바뀌는 내용은 모두 여기에 들어가므로 시스템 메시지는
+    요청 사이에 바이트 단위로 같게 유지된다 (Ollama 프롬프트 캐시 재사용).
+    """
+    budget = budget or PromptBudget()
+    sections = []
+    if summary:
+        sections.append(f"[Conversation Summary]\n{truncate_to_tokens(summary, budget.summary)}")
+    sections.append(f"[Relevant Documents]\n{render_documents(documents, budget.documents)}")
+    sections.append(f"[Chat Context]\n{render_recent(context, budget.recent, budget.recent_turn)}")
+    sections.append(
+        "다음 질문에 대해 정확한 정보를 기반으로 답변해주세요.\n"
+        f"Q. {truncate_to_tokens(question, budget.question)}"
+    )
+    prompt = "\n\n".join(sections)
+    return prompt, count_tokens(prompt)
+
+
+SUMMARY_INSTRUCTION = (
+    "You summarize a conversation between an owner (주인님) and a puppy pet bot (복슬이).\n"
+    "기존 요약과 새 대화를 합쳐 한국어로 5문장 이내로 요약하세요.\n"
+    "주인님에 대한 사실(이름, 취향, 기분, 일정)과 아직 이어지는 화제만 남기고, 인사말과 이모지는 빼세요.\n"
+    "요약문만 출력하세요."
+)
+
+
+def build_summary_messages(summary, entries, budget):
+    """기존 요약 + 요약되지 않은 턴들을 새 요약으로 합치는 메시지."""
+    turns = "\n".join(
+        f"{'주인님' if role == 'user' else '복슬이'}: {truncate_to_tokens(content, budget.recent_turn)}"
+        for role, content in entries
+    )
+    return [
+        ("system", SUMMARY_INSTRUCTION),
+        ("human", f"[기존 요약]\n{summary or '없음'}\n\n[새 대화]\n{turns}"),
+    ]
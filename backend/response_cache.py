@@ -0,0 +1,154 @@
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+from embedding_service import normalize_text
+
+# 이전 대화에 기대는(문맥 의존적인) 질문이나 개인적인 질문의 시작 토큰
+CONTEXT_DEPENDENT_TOKENS = (
+    "내가", "나는", "나를", "나의", "나한테", "제가", "저는", "저를", "저의", "저한테",
+    "우리", "아까", "방금", "그거", "그건", "그게", "그것", "이거", "이건", "저거",
+    "그럼", "그래서", "그러면",
+)
+CONTEXT_DEPENDENT_WORDS = ("내", "제", "나", "저", "더", "또")
+
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def is_context_dependent(question):
+    """이전 대화에 기대는 질문(그럼, 그거, 내가 ... 등)인지."""
+    for token in normalize_text(question).split(" "):
+        if token in CONTEXT_DEPENDENT_WORDS or token.startswith(CONTEXT_DEPENDENT_TOKENS):
+            return True
+    return False
+
+
+def is_cacheable(question, domains):
+    """정보성 질문만 캐시한다. general 도메인(잡담)이나 문맥 의존적인 질문은 건너뛴다."""
+    if domains == ["general"]:
+        return False
+    return not is_context_dependent(question)
+
+
+class ResponseCache:
+    """(도메인, 검색된 문서 id) 범위 안에서 답변을 재사용하는 캐시.
+
+    범위에 회원이 없으므로 캐시될 답변은 회원별 대화/요약 없이 만든 것이어야 한다.
+
+    정규화된 질문이 정확히 같으면 바로 돌려주고, 아니면 같은 범위의 질문
+    임베딩과 코사인 유사도가 similarity_threshold 이상인 답변을 찾는다.
+    항목은 TTL 이 지나면 만료되고, 개수/메모리 한도를 넘으면 LRU 로 버린다.
+    """
+
+    def __init__(self, ttl=3600, max_entries=1024, max_bytes=16 * 1024 * 1024, similarity_threshold=0.95):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._scopes = {}
+        self._bytes = 0
+        self._exact_hits = 0
+        self._semantic_hits = 0
+        self._misses = 0
+        self._bypassed = 0
+        self._evictions = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+            max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+            similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95")),
+        )
+
+    @staticmethod
+    def scope(domains, doc_ids):
+        return (tuple(domains), tuple(sorted(doc_ids)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+        keys = self._scopes[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._scopes[key[0]]
+
+    def _is_expired(self, entry, now):
+        return now - entry["created_at"] > self.ttl
+
+    def bypass(self):
+        self._bypassed += 1
+
+    def lookup(self, scope, question, query_embedding=None):
+        now = time.monotonic()
+        key = (scope, normalize_text(question))
+
+        entry = self._entries.get(key)
+        if entry is not None and self._is_expired(entry, now):
+            self._remove(key)
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._exact_hits += 1
+            return entry["answer"]
+
+        if query_embedding is not None:
+            query = np.asarray(query_embedding, dtype=np.float32)
+            best_key, best_score = None, self.similarity_threshold
+            for candidate_key in list(self._scopes.get(scope, ())):
+                candidate = self._entries[candidate_key]
+                if self._is_expired(candidate, now):
+                    self._remove(candidate_key)
+                    continue
+                if candidate["embedding"] is None:
+                    continue
+                score = float(candidate["embedding"] @ query)
+                if score >= best_score:
+                    best_key, best_score = candidate_key, score
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self._semantic_hits += 1
+                return self._entries[best_key]["answer"]
+
+        self._misses += 1
+        return None
+
+    def store(self, scope, question, answer, query_embedding=None):
+        key = (scope, normalize_text(question))
+        if key in self._entries:
+            self._remove(key)
+
+        embedding = None if query_embedding is None else np.asarray(query_embedding, dtype=np.float32)
+        size = ENTRY_OVERHEAD_BYTES + len(key[1].encode()) + len(answer.encode())
+        if embedding is not None:
+            size += embedding.nbytes
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = {
+            "answer": answer,
+            "embedding": embedding,
+            "created_at": time.monotonic(),
+            "size": size,
+        }
+        self._scopes.setdefault(scope, set()).add(key)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def stats(self):
+        lookups = self._exact_hits + self._semantic_hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "exact_hits": self._exact_hits,
+            "semantic_hits": self._semantic_hits,
+            "misses": self._misses,
+            "bypassed": self._bypassed,
+            "evictions": self._evictions,
+            "hit_rate": (self._exact_hits + self._semantic_hits) / lookups if lookups else 0.0,
+        }
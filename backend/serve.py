@@ -0,0 +1,90 @@
+"""멀티 워커 실행기.
+
+1. 임베딩 서버 프로세스를 띄운다 (모델은 이 프로세스에만 올라감).
+2. 문서 인덱스를 한 번만 만들고 대화 DB 테이블을 만든다.
+3. uvicorn 워커 N 개를 띄운다. 워커는 인덱스를 읽기 전용 mmap 으로 열고,
+   임베딩은 유닉스 소켓으로 요청하고, 대화는 SQLite(WAL) 에 함께 저장한다.
+
+python serve.py --workers 4 --llm-concurrency 4
+"""
+import argparse
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+backend_path = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("nk-bot.serve")
+
+
+def start_embedding_server(socket_path, timeout=60.0):
+    # 임베딩 서버는 모델을 직접 올려야 하므로 소켓 설정을 물려주지 않는다.
+    env = {key: value for key, value in os.environ.items() if key != "EMBEDDING_SERVER_SOCKET"}
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(backend_path, "embedding_server.py"), "--socket", socket_path],
+        cwd=backend_path,
+        env=env,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Embedding server exited with code {process.returncode}")
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(socket_path)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Embedding server did not start listening on {socket_path}")
+
+
+def prepare_shared_state():
+    """워커를 띄우기 전에 인덱스와 DB 를 한 번만 준비한다."""
+    from conversation_store import ConversationStore
+    from embedding_index import EmbeddingIndex
+    from ingest import documents_path
+    from model_registry import model_registry
+
+    started_at = time.perf_counter()
+    EmbeddingIndex(documents_path).build(model_registry.get_embeddings("retrieval").embed_documents)
+    logger.info("Document index ready in %.1fs", time.perf_counter() - started_at)
+    ConversationStore().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run nk-bot with several uvicorn workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8501)
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SERVER_SOCKET", "/tmp/nk-bot-embeddings.sock"))
+    parser.add_argument(
+        "--llm-concurrency", type=int,
+        help="total concurrent Ollama generations, split across workers (LLM_MAX_CONCURRENCY per worker)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    # 이 프로세스와 워커들은 임베딩을 서버로 요청한다.
+    os.environ["EMBEDDING_SERVER_SOCKET"] = args.socket
+    sys.path.insert(0, backend_path)
+
+    embedding_server = start_embedding_server(args.socket)
+    try:
+        prepare_shared_state()
+        os.environ["INDEX_READ_ONLY"] = "1"
+        if args.llm_concurrency:
+            os.environ["LLM_MAX_CONCURRENCY"] = str(max(1, args.llm_concurrency // args.workers))
+
+        import uvicorn
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, app_dir=backend_path)
+    finally:
+        embedding_server.terminate()
+        embedding_server.wait()
+
+
+if __name__ == "__main__":
+    main()
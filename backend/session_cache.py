@@ -0,0 +1,131 @@
+import os
+import time
+from collections import OrderedDict, deque
+
+SESSION_OVERHEAD_BYTES = 1024
+
+
+class ChatSession:
+    """WebSocket 연결이 쓰는 회원별 대화 상태 (최근 턴, 요약, 마지막 검색 결과)."""
+
+    def __init__(self, context_key, turns, summary, window):
+        self.context_key = context_key
+        self.turns = deque(turns, maxlen=window)
+        self.summary = summary
+        self.domains = []
+        self.search_domains = []
+        self.doc_ids = []
+        self.relevant_docs = []
+        self.query_embedding = None
+        self.last_active = time.monotonic()
+        self.size = 0
+
+    def remember_retrieval(self, domains, search_domains, doc_ids, relevant_docs, query_embedding):
+        self.domains = domains
+        self.search_domains = search_domains
+        self.doc_ids = doc_ids
+        self.relevant_docs = relevant_docs
+        self.query_embedding = query_embedding
+
+    def estimate_size(self):
+        size = SESSION_OVERHEAD_BYTES + len(self.summary.encode())
+        size += sum(len(turn.encode()) for turn in self.turns)
+        size += sum(len(doc.get("text", "").encode()) for doc in self.relevant_docs)
+        if self.query_embedding is not None:
+            size += 4 * len(self.query_embedding)
+        return size
+
+
+class SessionCache:
+    """회원별 ChatSession 을 메모리에 두는 LRU 캐시.
+
+    idle_timeout 동안 쓰이지 않은 세션, max_sessions 개나 max_bytes 를 넘는
+    가장 오래된 세션부터 버린다. 대화는 ConversationStore 에 write-behind 로
+    이미 저장되므로 버려진 세션은 다음 접속 때 저장소에서 다시 불러온다.
+    """
+
+    def __init__(self, window=5, max_sessions=1000, idle_timeout=1800, max_bytes=64 * 1024 * 1024):
+        self._window = window
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._loads = 0
+        self._evictions = 0
+        self._reused_retrievals = 0
+
+    @classmethod
+    def from_env(cls, window=5):
+        return cls(
+            window=window,
+            max_sessions=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "1000")),
+            idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT_SECONDS", "1800")),
+            max_bytes=int(os.getenv("SESSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        )
+
+    def _remove(self, member_id):
+        session = self._sessions.pop(member_id)
+        self._bytes -= session.size
+        self._evictions += 1
+
+    def _evict(self):
+        now = time.monotonic()
+        # 접근 순서대로 정렬되어 있으므로 앞에서부터 오래된 세션만 보면 된다.
+        while self._sessions:
+            member_id, session = next(iter(self._sessions.items()))
+            if (
+                now - session.last_active > self.idle_timeout
+                or len(self._sessions) > self.max_sessions
+                or self._bytes > self.max_bytes
+            ):
+                self._remove(member_id)
+            else:
+                break
+
+    async def get(self, context_key, load):
+        """세션을 돌려준다. 없거나 날짜가 바뀌었으면 await load() 의 (turns, summary) 로 만든다."""
+        member_id = context_key[0]
+        session = self._sessions.get(member_id)
+        if session is not None and session.context_key == context_key:
+            self._hits += 1
+        else:
+            turns, summary = await load()
+            if member_id in self._sessions:
+                self._remove(member_id)
+            session = self._sessions[member_id] = ChatSession(context_key, turns, summary, self._window)
+            self._loads += 1
+        self.touch(session)
+        return session
+
+    def touch(self, session):
+        """세션을 방금 쓴 것으로 표시하고 크기를 다시 계산한 뒤 한도를 적용한다."""
+        member_id = session.context_key[0]
+        if self._sessions.get(member_id) is not session:
+            return
+        session.last_active = time.monotonic()
+        self._sessions.move_to_end(member_id)
+        size = session.estimate_size()
+        self._bytes += size - session.size
+        session.size = size
+        self._evict()
+
+    def reuse_retrieval(self, session):
+        """후속 질문에 세션의 마지막 검색 결과를 그대로 쓴다."""
+        self._reused_retrievals += 1
+        return session.domains, session.search_domains, session.doc_ids, session.relevant_docs, session.query_embedding
+
+    def find(self, context_key):
+        session = self._sessions.get(context_key[0])
+        return session if session is not None and session.context_key == context_key else None
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "hits": self._hits,
+            "loads": self._loads,
+            "evictions": self._evictions,
+            "reused_retrievals": self._reused_retrievals,
+        }
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import threading
+
+# 모든 연결에 적용하는 설정: WAL + 동시 읽기/쓰기 대기 시간.
+# 여러 프로세스가 동시에 열 때 journal_mode 변경이 잠금을 기다리도록 busy_timeout 을 먼저 건다.
+PRAGMAS = (
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+# (스레드 id, DB 경로) -> 연결. 연결은 만든 스레드만 쓰지만 close_connections() 가
+# 종료 시 다른 스레드에서 한꺼번에 닫을 수 있도록 프로세스 전체에서 관리한다.
+_lock = threading.Lock()
+_connections = {}
+_pid = None
+
+
+def get_connection(db_path):
+    """스레드(그리고 프로세스)마다 DB 파일별 연결 하나를 재사용한다."""
+    global _pid
+    key = (threading.get_ident(), os.path.abspath(db_path))
+    with _lock:
+        if _pid != os.getpid():
+            # fork 된 자식 프로세스는 부모의 연결을 물려받아 쓰면 안 된다.
+            _pid = os.getpid()
+            _connections.clear()
+        conn = _connections.get(key)
+    if conn is None:
+        os.makedirs(os.path.dirname(key[1]), exist_ok=True)
+        conn = sqlite3.connect(key[1], check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with _lock:
+            _connections[key] = conn
+    return conn
+
+
+def close_connections(db_path=None):
+    """이 프로세스가 연 연결을 닫는다 (db_path 가 있으면 그 파일의 연결만).
+
+    연결을 쓰는 스레드 풀을 먼저 종료한 뒤에 부른다.
+    """
+    path = os.path.abspath(db_path) if db_path else None
+    with _lock:
+        keys = [key for key in _connections if path is None or key[1] == path]
+        conns = [_connections.pop(key) for key in keys]
+    for conn in conns:
+        conn.close()